@@ -10,9 +10,14 @@ This script fixes:
 2. Missing workspace data (extracts from tags)
 3. Missing is_360_queue data (detects 360 queue tags)
 
+Only tags and metric_date are written; workspace, is_360_queue and
+queue_type_360 are derived from the tags by the assign_workspace_from_tags
+trigger. classify_tags mirrors that trigger for the log/dry-run preview.
+
 Usage:
   python backfill_dates_and_workspace.py
   python backfill_dates_and_workspace.py --limit 100
+  python backfill_dates_and_workspace.py --workers 32
   python backfill_dates_and_workspace.py --conversation-id 215472047410898
 """
 
@@ -22,11 +27,22 @@ import json
 import time
 import logging
 import argparse
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterator
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+try:
+    import orjson  # optional: faster decoding of Intercom responses
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
 # Configuration
@@ -44,68 +60,163 @@ if not SUPABASE_SERVICE_KEY:
 INTERCOM_BASE = "https://api.intercom.io"
 INTERCOM_API_VERSION = "2.14"
 
+# Concurrency: number of Intercom requests kept in flight, and the global
+# request budget shared by all workers. Intercom allows 1000 requests per
+# minute, enforced in 10-second windows; stay just under 83 per window.
+DEFAULT_WORKERS = 16
+INTERCOM_RATE_LIMIT = 83
+INTERCOM_RATE_WINDOW_SECONDS = 10
+
+# Retries for throttled (429) or failed (5xx) Intercom requests
+INTERCOM_MAX_RETRIES = 5
+
+# Number of qa_metrics updates sent per bulk RPC call
+UPDATE_BATCH_SIZE = 100
+
+# Rows read from qa_metrics per page (PostgREST's default max-rows)
+PAGE_SIZE = 1000
+
+# Conversations requested per Intercom search call (Intercom's max per_page)
+SEARCH_BATCH_SIZE = 150
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
 # Supabase Client
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
-# Tag definitions for workspace and 360 queue detection
-WORKSPACE_TAGS = {
-    'SkyPrivate': ['skyprivate', 'SkyPrivate'],
-    'CamModelDirectory': ['cmd', 'CMD', 'cammodeldirectory', 'CamModelDirectory'],
+# Keep-alive session for bulk RPC writes, which send a pre-encoded body
+supabase_session = requests.Session()
+supabase_session.headers.update({
+    "apikey": SUPABASE_SERVICE_KEY,
+    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+    "Content-Type": "application/json",
+    "Prefer": "return=minimal"
+})
+
+# Tag rules for the log/dry-run preview. These mirror the database's
+# classify_conversation_tags() (migration 20261015000002), which is what
+# actually writes workspace, is_360_queue and queue_type_360: substring
+# matches on the lowercased, space-joined tags.
+WORKSPACE_KEYWORDS = {
+    'SkyPrivate': ['skyprivate'],
+    'CamModelDirectory': ['cmd', 'cammodeldirectory'],
 }
 
-BILLING_360_TAGS = [
-    'payments', 'billing-verifications', 'Billing - top-up-issue',
-    'billing', 'top-up', 'billing-top-up-issue'
+BILLING_360_PATTERNS = [
+    'billing - top-up issue', 'billing verifications', '3 - payments', '3 - refunds'
 ]
 
-CEQ_360_TAGS = [
-    'reports', 'scammers', 'ceq-verifications',
-    'publicprofile', 'ceq'
+CEQ_360_PATTERNS = [
+    'ceq verifications', 'public profile', '3 - reports', '3 - scammers'
 ]
 
 
-def determine_workspace(tags: list) -> str:
-    """Determine workspace from tags"""
-    lower_tags = [t.lower() for t in tags]
-    
-    for workspace, identifiers in WORKSPACE_TAGS.items():
-        if any(t.lower() in lower_tags for t in identifiers):
-            return workspace
+def classify_tags(tags: list) -> tuple:
+    """
+    Determine (workspace, is_360_queue, queue_type_360) from tags the way
+    the database trigger will. Returns (None, None, None) for no tags, since
+    the trigger then leaves the stored classification alone.
+    """
+    if not tags:
+        return None, None, None
     
-    return 'Unknown'
-
-
-def determine_360_queue(tags: list) -> tuple:
-    """Determine if conversation is 360 queue and what type"""
-    lower_tags = [t.lower() for t in tags]
+    tag_text = ' '.join(tags).lower()
     
-    is_billing = any(t.lower() in lower_tags for t in BILLING_360_TAGS)
-    is_ceq = any(t.lower() in lower_tags for t in CEQ_360_TAGS)
+    base_workspace = next(
+        (ws for ws, keywords in WORKSPACE_KEYWORDS.items() if any(k in tag_text for k in keywords)),
+        'Unknown'
+    )
+    is_billing = any(p in tag_text for p in BILLING_360_PATTERNS)
+    is_ceq = any(p in tag_text for p in CEQ_360_PATTERNS)
     
     if is_billing and is_ceq:
-        return True, 'both'
+        queue_type = 'both'
     elif is_billing:
-        return True, 'billing'
+        queue_type = 'billing'
     elif is_ceq:
-        return True, 'ceq'
+        queue_type = 'ceq'
+    else:
+        return base_workspace, False, None
     
-    return False, None
+    # 360 conversations without a workspace keyword default to SkyPrivate
+    workspace = '360_SkyPrivate' if base_workspace == 'Unknown' else f'360_{base_workspace}'
+    return workspace, True, queue_type
 
 
-def fetch_conversation_from_intercom(conversation_id: str) -> dict | None:
-    """Fetch full conversation details from Intercom API"""
-    url = f"{INTERCOM_BASE}/conversations/{conversation_id}"
-    headers = {
+class RateLimiter:
+    """Token bucket shared by all worker threads"""
+
+    def __init__(self, rate: float, per: float = 1.0):
+        self.capacity = rate
+        self.fill_rate = rate / per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(INTERCOM_RATE_LIMIT, INTERCOM_RATE_WINDOW_SECONDS)
+
+
+def create_intercom_session(pool_size: int = DEFAULT_WORKERS) -> requests.Session:
+    """Create a keep-alive Session with Intercom headers and retrying adapter"""
+    session = requests.Session()
+    session.headers.update({
         "Authorization": f"Bearer {INTERCOM_TOKEN}",
         "Accept": "application/json",
         "Intercom-Version": INTERCOM_API_VERSION
-    }
+    })
+    # Exponential backoff, but a 429's Retry-After header takes precedence
+    retry = Retry(
+        total=INTERCOM_MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # POST is only used for /conversations/search, which is read-only
+        allowed_methods=["GET", "POST"],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+
+# Shared by all worker threads; resized in main() to match --workers
+intercom_session = create_intercom_session()
+
+
+def json_loads(content):
+    """Decode JSON bytes/str with orjson when installed, else the stdlib"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+
+def json_dumps(data) -> bytes:
+    """Encode compact JSON bytes with orjson when installed, else the stdlib"""
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def fetch_conversation_from_intercom(conversation_id: str) -> dict | None:
+    """Fetch full conversation details from Intercom API"""
+    url = f"{INTERCOM_BASE}/conversations/{conversation_id}"
 
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        rate_limiter.acquire()
+        response = intercom_session.get(url, timeout=30)
         
         if response.status_code == 404:
             logger.warning(f"Conversation {conversation_id} not found in Intercom")
@@ -115,80 +226,158 @@ def fetch_conversation_from_intercom(conversation_id: str) -> dict | None:
             logger.error(f"Failed to fetch conversation {conversation_id}: {response.status_code}")
             return None
 
-        return response.json()
+        return json_loads(response.content)
     except Exception as e:
         logger.error(f"Error fetching conversation {conversation_id}: {e}")
         return None
 
 
-def extract_conversation_data(conversation: dict) -> dict:
-    """Extract date, tags, workspace, and 360 queue info from conversation"""
+def search_conversations_from_intercom(conversation_ids: list) -> dict:
+    """
+    Fetch up to SEARCH_BATCH_SIZE conversations per request via
+    POST /conversations/search. Returns {conversation_id: conversation}.
+    """
+    url = f"{INTERCOM_BASE}/conversations/search"
+    body = {
+        "query": {"field": "id", "operator": "IN", "value": conversation_ids},
+        "pagination": {"per_page": SEARCH_BATCH_SIZE}
+    }
+    found = {}
+
+    try:
+        while True:
+            rate_limiter.acquire()
+            response = intercom_session.post(url, json=body, timeout=60)
+
+            if response.status_code != 200:
+                logger.error(f"Conversation search failed: {response.status_code}")
+                break
+
+            data = json_loads(response.content)
+            for conversation in data.get('conversations', []):
+                found[str(conversation.get('id'))] = conversation
+
+            starting_after = ((data.get('pages') or {}).get('next') or {}).get('starting_after')
+            if not starting_after:
+                break
+            body["pagination"]["starting_after"] = starting_after
+    except Exception as e:
+        logger.error(f"Error searching {len(conversation_ids)} conversations: {e}")
+
+    return found
+
+
+def fetch_conversations_from_intercom(conversation_ids: list) -> dict:
+    """
+    Fetch a batch of conversations with one search call, falling back to
+    individual GETs for any the search did not return.
+    """
+    found = search_conversations_from_intercom(conversation_ids)
+    for conversation_id in conversation_ids:
+        if conversation_id not in found:
+            conversation = fetch_conversation_from_intercom(conversation_id)
+            if conversation:
+                found[conversation_id] = conversation
+    return found
+
+
+def extract_conversations_data(conversations: list) -> list:
+    """
+    Extract date, tags, workspace, and 360 queue info for a page of
+    conversations in one pass. Dates are converted once per UTC day.
+    """
+    results = []
+    append = results.append
+    day_to_date = {}
     
-    # Get the REAL created_at timestamp
-    created_at = conversation.get('created_at')
-    if created_at:
-        real_date = datetime.fromtimestamp(created_at, tz=timezone.utc).date().isoformat()
-    else:
+    for conversation in conversations:
+        # Get the REAL created_at timestamp
+        created_at = conversation.get('created_at')
         real_date = None
+        if created_at:
+            day = int(created_at) // 86400
+            real_date = day_to_date.get(day)
+            if real_date is None:
+                real_date = datetime.fromtimestamp(created_at, tz=timezone.utc).date().isoformat()
+                day_to_date[day] = real_date
+        
+        # Extract tags
+        tags_data = conversation.get('tags', {}).get('tags', [])
+        tags = [name for name in (tag.get('name') for tag in tags_data) if name]
+        
+        # Determine workspace and 360 queue
+        workspace, is_360_queue, queue_type_360 = classify_tags(tags)
+        
+        append({
+            'real_date': real_date,
+            'tags': tags,
+            'workspace': workspace,
+            'is_360_queue': is_360_queue,
+            'queue_type_360': queue_type_360,
+        })
     
-    # Extract tags
-    tags_data = conversation.get('tags', {}).get('tags', [])
-    tags = [tag.get('name', '') for tag in tags_data if tag.get('name')]
-    
-    # Determine workspace
-    workspace = determine_workspace(tags)
-    
-    # Determine 360 queue
-    is_360_queue, queue_type_360 = determine_360_queue(tags)
-    
+    return results
+
+
+def extract_conversation_data(conversation: dict) -> dict:
+    """Extract date, tags, workspace, and 360 queue info from conversation"""
+    return extract_conversations_data([conversation])[0]
+
+
+def build_update_row(conversation_id: str, data: dict) -> dict:
+    """Build the bulk_update_qa_metrics row for one conversation"""
     return {
-        'real_date': real_date,
-        'tags': tags,
-        'workspace': workspace,
-        'is_360_queue': is_360_queue,
-        'queue_type_360': queue_type_360,
+        'conversation_id': conversation_id,
+        'conversation_tags': data['tags'],
+        # Only update date if we got a real date (NULL keeps the current one)
+        'metric_date': data['real_date'],
     }
 
 
-def update_qa_metric(conversation_id: str, data: dict) -> bool:
-    """Update qa_metrics record with correct data"""
+def update_qa_metrics_batch(rows: list) -> bool:
+    """Update many qa_metrics records in a single RPC call"""
+    if not rows:
+        return True
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/rpc/bulk_update_qa_metrics"
     try:
-        update_data = {
-            'workspace': data['workspace'],
-            'is_360_queue': data['is_360_queue'],
-            'queue_type_360': data['queue_type_360'],
-            'tags': data['tags'],
-        }
-        
-        # Only update date if we got a real date
-        if data['real_date']:
-            update_data['metric_date'] = data['real_date']
-        
-        response = supabase.table('qa_metrics').update(update_data).eq(
-            'conversation_id', conversation_id
-        ).execute()
-        
+        response = supabase_session.post(url, data=json_dumps({'rows': rows}), timeout=120)
+        if response.status_code not in (200, 204):
+            logger.error(f"Failed to update batch of {len(rows)} conversations: "
+                         f"{response.status_code} - {response.text}")
+            return False
         return True
     except Exception as e:
-        logger.error(f"Failed to update {conversation_id}: {e}")
+        logger.error(f"Failed to update batch of {len(rows)} conversations: {e}")
         return False
 
 
-def get_conversations_to_update(limit: int = None, conversation_id: str = None) -> list:
-    """Get list of conversation IDs to update"""
-    try:
-        query = supabase.table('qa_metrics').select('conversation_id, metric_date, workspace')
+def get_conversations_to_update(limit: int = None, conversation_id: str = None) -> Iterator[dict]:
+    """Stream qa_metrics rows to update, one page at a time"""
+    start = 0
+    while True:
+        end = start + PAGE_SIZE - 1
+        if limit:
+            end = min(end, limit - 1)
+        if end < start:
+            return
         
-        if conversation_id:
-            query = query.eq('conversation_id', conversation_id)
-        elif limit:
-            query = query.limit(limit)
+        try:
+            query = supabase.table('qa_metrics').select('conversation_id, metric_date, workspace, is_360_queue, queue_type_360, conversation_tags')
+            
+            if conversation_id:
+                query = query.eq('conversation_id', conversation_id)
+            
+            response = query.order('conversation_id').range(start, end).execute()
+        except Exception as e:
+            logger.error(f"Failed to fetch conversations at offset {start}: {e}")
+            return
         
-        response = query.execute()
-        return response.data
-    except Exception as e:
-        logger.error(f"Failed to fetch conversations: {e}")
-        return []
+        rows = response.data or []
+        yield from rows
+        
+        if len(rows) < end - start + 1:
+            return
+        start = end + 1
 
 
 def main():
@@ -196,65 +385,132 @@ def main():
     parser.add_argument("--limit", type=int, help="Limit number of conversations to process")
     parser.add_argument("--conversation-id", type=str, help="Process a specific conversation ID")
     parser.add_argument("--dry-run", action="store_true", help="Don't update, just show what would be done")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Concurrent Intercom requests (default: {DEFAULT_WORKERS})")
     
     args = parser.parse_args()
     
+    global intercom_session
+    intercom_session = create_intercom_session(max(1, args.workers))
+    
     logger.info("Starting backfill process...")
     
-    # Get conversations to process
+    # Stream conversations to process
     conversations = get_conversations_to_update(
         limit=args.limit,
         conversation_id=args.conversation_id
     )
     
-    logger.info(f"Found {len(conversations)} conversations to process")
-    
+    processed = 0
+    duplicates = 0
+    unchanged = 0
+    seen_ids = set()
     updated = 0
     failed = 0
     skipped = 0
+    pending = []
     
-    for i, conv in enumerate(conversations):
-        conv_id = conv['conversation_id']
-        current_date = conv.get('metric_date')
-        current_workspace = conv.get('workspace')
-        
-        logger.info(f"[{i+1}/{len(conversations)}] Processing {conv_id}...")
-        
-        # Fetch from Intercom
-        intercom_data = fetch_conversation_from_intercom(conv_id)
-        
-        if not intercom_data:
-            skipped += 1
-            continue
-        
-        # Extract data
-        extracted = extract_conversation_data(intercom_data)
-        
-        # Log changes
-        date_changed = extracted['real_date'] and extracted['real_date'] != current_date
-        workspace_changed = extracted['workspace'] != current_workspace
-        
-        if date_changed:
-            logger.info(f"  Date: {current_date} -> {extracted['real_date']}")
-        if workspace_changed:
-            logger.info(f"  Workspace: {current_workspace} -> {extracted['workspace']}")
-        if extracted['is_360_queue']:
-            logger.info(f"  360 Queue: {extracted['queue_type_360']}")
-        
-        # Update if not dry run
-        if not args.dry_run:
-            if update_qa_metric(conv_id, extracted):
-                updated += 1
-            else:
-                failed += 1
+    def flush_pending():
+        nonlocal updated, failed
+        if update_qa_metrics_batch(pending):
+            updated += len(pending)
         else:
-            updated += 1
-        
-        # Rate limit: 100ms between requests
-        time.sleep(0.1)
+            failed += len(pending)
+        pending.clear()
+    
+    # Fetch from Intercom concurrently; each result is handled on the main
+    # thread as soon as its request completes
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            while True:
+                page = list(islice(conversations, PAGE_SIZE))
+                if not page:
+                    break
+                
+                # Fetch each conversation once; the bulk UPDATE matches every
+                # row with that conversation_id
+                unique = []
+                for conv in page:
+                    conv_id = conv['conversation_id']
+                    if conv_id in seen_ids:
+                        duplicates += 1
+                        continue
+                    seen_ids.add(conv_id)
+                    unique.append(conv)
+                
+                batches = [unique[j:j + SEARCH_BATCH_SIZE] for j in range(0, len(unique), SEARCH_BATCH_SIZE)]
+                futures = {
+                    executor.submit(
+                        fetch_conversations_from_intercom,
+                        [conv['conversation_id'] for conv in batch]
+                    ): batch
+                    for batch in batches
+                }
+                
+                fetched = []
+                for future in as_completed(futures):
+                    found = future.result()
+                    
+                    for conv in futures[future]:
+                        intercom_data = found.get(conv['conversation_id'])
+                        if not intercom_data:
+                            processed += 1
+                            skipped += 1
+                            logger.info(f"[{processed}] Skipped {conv['conversation_id']}")
+                            continue
+                        fetched.append((conv, intercom_data))
+                
+                # Extract data for the whole page in one pass
+                extracted_page = extract_conversations_data([data for _, data in fetched])
+                
+                for (conv, _), extracted in zip(fetched, extracted_page):
+                    conv_id = conv['conversation_id']
+                    current_date = conv.get('metric_date')
+                    current_workspace = conv.get('workspace')
+                    processed += 1
+                    
+                    logger.info(f"[{processed}] Processing {conv_id}...")
+                    
+                    # Log changes (metric_date comes back as a timestamptz string)
+                    date_changed = extracted['real_date'] and extracted['real_date'] != (current_date or '')[:10]
+                    tags_changed = extracted['tags'] != (conv.get('conversation_tags') or [])
+                    # The bulk update also rewrites a stale classification
+                    # (None means no tags: the stored one is kept)
+                    workspace_changed = (extracted['workspace'] is not None
+                                         and extracted['workspace'] != current_workspace)
+                    classification_changed = extracted['workspace'] is not None and (
+                        extracted['workspace'], extracted['is_360_queue'], extracted['queue_type_360']
+                    ) != (current_workspace, conv.get('is_360_queue'), conv.get('queue_type_360'))
+                    
+                    if date_changed:
+                        logger.info(f"  Date: {current_date} -> {extracted['real_date']}")
+                    if workspace_changed:
+                        logger.info(f"  Workspace: {current_workspace} -> {extracted['workspace']}")
+                    if extracted['is_360_queue']:
+                        logger.info(f"  360 Queue: {extracted['queue_type_360']}")
+                    
+                    # Nothing to write if tags, date and classification already match
+                    if not date_changed and not tags_changed and not classification_changed:
+                        unchanged += 1
+                        continue
+                    
+                    # Queue update if not dry run
+                    if not args.dry_run:
+                        pending.append(build_update_row(conv_id, extracted))
+                        if len(pending) >= UPDATE_BATCH_SIZE:
+                            flush_pending()
+                    else:
+                        updated += 1
+    finally:
+        # Write whatever is left, even if the loop was interrupted
+        if pending:
+            flush_pending()
     
     logger.info("=" * 50)
     logger.info(f"Backfill complete!")
+    logger.info(f"  Processed: {processed}")
+    logger.info(f"  Duplicate IDs: {duplicates}")
+    logger.info(f"  Unchanged: {unchanged}")
     logger.info(f"  Updated: {updated}")
     logger.info(f"  Failed: {failed}")
     logger.info(f"  Skipped: {skipped}")
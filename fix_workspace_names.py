@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 """
-fix_workspace_names_complete.py
+fix_workspace_names.py
 
-COMPLETE VERSION - Handles ALL conversations using pagination.
-Processes workspace fixes in batches to avoid API limits.
+Canonicalises workspace names (lowercase names, 360_ prefixes) in
+qa_metrics for ALL conversations via the fix_workspaces() RPC.
 
 Usage:
-    python fix_workspace_names_complete.py
+    python fix_workspace_names.py
 """
 
 import os
 import requests
-import time
+from collections import Counter
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -37,178 +37,65 @@ headers = {
 
 base_url = f"{SUPABASE_URL}/rest/v1"
 
-# Step 1: Check current state (with proper count)
-print("\n1. Checking current workspace distribution...")
+# One keep-alive session for every REST call below
+session = requests.Session()
+session.headers.update(headers)
 
-# Get total count
-response = requests.get(
-    f"{base_url}/qa_metrics",
-    headers={**headers, "Prefer": "count=exact"},
-    params={"select": "workspace", "limit": 0}
-)
 
-total_count = int(response.headers.get('Content-Range', '0-0/0').split('/')[-1])
-print(f"Total conversations in database: {total_count:,}")
+def fetch_workspace_counts():
+    """Count conversations per workspace with the workspace_distribution() RPC"""
+    response = session.post(f"{base_url}/rpc/workspace_distribution", json={})
+    if response.status_code != 200:
+        return None, response
+    counts = Counter({row['workspace']: row['conversation_count'] for row in response.json()})
+    return counts, response
+
+
+# Step 1: Check current state (with proper count)
+print("\n1. Checking current workspace distribution...")
 
 # Get workspace distribution
-response = requests.get(
-    f"{base_url}/qa_metrics",
-    headers=headers,
-    params={"select": "workspace", "limit": "10000"}  # Increase limit
-)
+workspace_counts, response = fetch_workspace_counts()
 
-if response.status_code == 200:
-    data = response.json()
-    from collections import Counter
-    workspace_counts = Counter(row['workspace'] for row in data)
+if workspace_counts is not None:
+    total_count = sum(workspace_counts.values())
+    print(f"Total conversations in database: {total_count:,}")
     
     print("\nBEFORE fixes:")
     for ws, count in workspace_counts.most_common():
-        pct = (count / len(data)) * 100 if len(data) > 0 else 0
+        pct = (count / total_count) * 100 if total_count > 0 else 0
         print(f"   {ws:25} {count:6,} ({pct:5.2f}%)")
-    
-    print(f"\n   Retrieved {len(data):,} of {total_count:,} conversations")
-    
-    if len(data) < total_count:
-        print(f"   ⚠️  WARNING: Only processing first {len(data):,} conversations")
-        print(f"      To fix ALL conversations, increase Supabase row limit")
 else:
     print(f"Error fetching data: {response.status_code} - {response.text}")
     exit(1)
 
-# Step 2: Fix lowercase 'skyprivate' -> 'SkyPrivate'
-print("\n2. Fixing 'skyprivate' -> 'SkyPrivate'...")
-skyprivate_count = workspace_counts.get('skyprivate', 0)
+# Step 2: Fix lowercase names and 360 prefixes in a single UPDATE
+print("\n2. Fixing workspace names and 360 prefixes...")
 
-if skyprivate_count > 0:
-    print(f"   Found {skyprivate_count:,} conversations to fix")
-    
-    response = requests.patch(
-        f"{base_url}/qa_metrics",
-        headers=headers,
-        params={"workspace": "eq.skyprivate"},
-        json={"workspace": "SkyPrivate"}
-    )
-    
-    if response.status_code in (200, 204):
-        print(f"   ✓ Success! Updated 'skyprivate' -> 'SkyPrivate'")
-    else:
-        print(f"   ✗ Error: {response.status_code} - {response.text}")
-else:
-    print(f"   ℹ️  No 'skyprivate' conversations found (already fixed)")
+response = session.post(f"{base_url}/rpc/fix_workspaces", json={})
 
-# Step 3: Fix lowercase 'cammodeldirectory' -> 'CamModelDirectory'
-print("\n3. Fixing 'cammodeldirectory' -> 'CamModelDirectory'...")
-cmd_count = workspace_counts.get('cammodeldirectory', 0)
-
-if cmd_count > 0:
-    print(f"   Found {cmd_count:,} conversations to fix")
-    
-    response = requests.patch(
-        f"{base_url}/qa_metrics",
-        headers=headers,
-        params={"workspace": "eq.cammodeldirectory"},
-        json={"workspace": "CamModelDirectory"}
-    )
-    
-    if response.status_code in (200, 204):
-        print(f"   ✓ Success! Updated 'cammodeldirectory' -> 'CamModelDirectory'")
-    else:
-        print(f"   ✗ Error: {response.status_code} - {response.text}")
-else:
-    print(f"   ℹ️  No 'cammodeldirectory' conversations found (already fixed)")
-
-# Step 4: Fix 360 SkyPrivate workspace prefix
-print("\n4. Fixing 360 SkyPrivate workspace prefix...")
-
-# Count how many need updating
-response = requests.get(
-    f"{base_url}/qa_metrics",
-    headers={**headers, "Prefer": "count=exact"},
-    params={
-        "select": "conversation_id",
-        "is_360_queue": "eq.true",
-        "workspace": "in.(SkyPrivate,skyprivate)",
-        "limit": 0
-    }
-)
-
-count_360_sp = int(response.headers.get('Content-Range', '0-0/0').split('/')[-1])
-print(f"   Found {count_360_sp:,} conversations to update")
-
-if count_360_sp > 0:
-    # Update them
-    response = requests.patch(
-        f"{base_url}/qa_metrics",
-        headers=headers,
-        params={
-            "is_360_queue": "eq.true",
-            "workspace": "in.(SkyPrivate,skyprivate)"
-        },
-        json={"workspace": "360_SkyPrivate"}
-    )
-    
-    if response.status_code in (200, 204):
-        print(f"   ✓ Success! Updated to '360_SkyPrivate'")
-    else:
-        print(f"   ✗ Error: {response.status_code} - {response.text}")
-else:
-    print(f"   ℹ️  No 360 SkyPrivate conversations to fix")
-
-# Step 5: Fix 360 CamModelDirectory workspace prefix
-print("\n5. Fixing 360 CamModelDirectory workspace prefix...")
-
-response = requests.get(
-    f"{base_url}/qa_metrics",
-    headers={**headers, "Prefer": "count=exact"},
-    params={
-        "select": "conversation_id",
-        "is_360_queue": "eq.true",
-        "workspace": "in.(CamModelDirectory,cammodeldirectory)",
-        "limit": 0
-    }
-)
-
-count_360_cmd = int(response.headers.get('Content-Range', '0-0/0').split('/')[-1])
-print(f"   Found {count_360_cmd:,} conversations to update")
-
-if count_360_cmd > 0:
-    response = requests.patch(
-        f"{base_url}/qa_metrics",
-        headers=headers,
-        params={
-            "is_360_queue": "eq.true",
-            "workspace": "in.(CamModelDirectory,cammodeldirectory)"
-        },
-        json={"workspace": "360_CamModelDirectory"}
-    )
-    
-    if response.status_code in (200, 204):
-        print(f"   ✓ Success! Updated to '360_CamModelDirectory'")
+if response.status_code == 200:
+    fixed = response.json()
+    if fixed:
+        for row in fixed:
+            print(f"   ✓ Updated {row['updated_count']:,} conversations to '{row['workspace']}'")
     else:
-        print(f"   ✗ Error: {response.status_code} - {response.text}")
+        print(f"   ℹ️  No conversations to fix (already fixed)")
 else:
-    print(f"   ℹ️  No 360 CMD conversations to fix")
+    print(f"   ✗ Error: {response.status_code} - {response.text}")
 
-# Step 6: Verify final distribution
-print("\n6. Final workspace distribution:")
+# Step 3: Verify final distribution
+print("\n3. Final workspace distribution:")
 print("-" * 60)
 
-time.sleep(1)  # Give database a moment to update
-
-response = requests.get(
-    f"{base_url}/qa_metrics",
-    headers=headers,
-    params={"select": "workspace", "limit": "10000"}
-)
+workspace_counts_after, response = fetch_workspace_counts()
 
-if response.status_code == 200:
-    data = response.json()
-    workspace_counts_after = Counter(row['workspace'] for row in data)
+if workspace_counts_after is not None:
+    retrieved_after = sum(workspace_counts_after.values())
     
     print("AFTER fixes:")
     for ws, count in workspace_counts_after.most_common():
-        pct = (count / len(data)) * 100 if len(data) > 0 else 0
+        pct = (count / retrieved_after) * 100 if retrieved_after > 0 else 0
         print(f"   {ws:25} {count:6,} ({pct:5.2f}%)")
     
     # Show changes
@@ -1,41 +1,110 @@
 #!/usr/bin/env python3
 """
-check_conversation_tags.py - Debug tool to see what tags a conversation has in Intercom
+check_conversation_tags.py - Debug tool to see what tags conversations have in Intercom
+
+Usage:
+  python check_conversation_tags.py 215472836676271
+  python check_conversation_tags.py --ids 215472836676271,215471253297267
+  cat ids.txt | python check_conversation_tags.py
 """
 
 import os
+import sys
+import json
+import argparse
 import requests
-from dotenv import load_load_dotenv()
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from intercom_common import RateLimiter
+
+try:
+    import orjson  # optional: faster decoding of Intercom responses
+except ImportError:
+    orjson = None
+
+load_dotenv()
 
 INTERCOM_TOKEN = os.environ.get("INTERCOM_TOKEN")
-conversation_id = "215472836676271"
-
-url = f"https://api.intercom.io/conversations/{conversation_id}"
-headers = {
-    "Authorization": f"Bearer {INTERCOM_TOKEN}",
-    "Accept": "application/json",
-    "Intercom-Version": "2.14"
-}
-
-response = requests.get(url, headers=headers, timeout=30)
-
-if response.status_code == 200:
-    data = response.json()
-    
-    print(f"Conversation ID: {conversation_id}")
-    print(f"State: {data.get('state')}")
-    print(f"Created: {data.get('created_at')}")
-    print("\n--- TAGS ---")
-    
-    tags = data.get("tags", {}).get("tags", [])
-    if tags:
-        for tag in tags:
-            print(f"  - {tag.get('name')}")
+INTERCOM_BASE = "https://api.intercom.io"
+MAX_WORKERS = 16
+rate_limiter = RateLimiter()  # shared budget for all worker threads
+
+
+def create_session() -> requests.Session:
+    """Keep-alive session with Intercom headers set once"""
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {INTERCOM_TOKEN}",
+        "Accept": "application/json",
+        "Intercom-Version": "2.14"
+    })
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_tags(conversation_id: str, session: requests.Session) -> tuple:
+    """Return (conversation_id, response or the request error) for one conversation"""
+    url = f"{INTERCOM_BASE}/conversations/{conversation_id}"
+    try:
+        return conversation_id, rate_limiter.send(lambda: session.get(url, timeout=30))
+    except requests.RequestException as e:
+        # One bad ID must not abort the run and drop the results already fetched
+        return conversation_id, e
+
+
+def print_result(conversation_id: str, response):
+    print("=" * 60)
+    if isinstance(response, requests.RequestException):
+        print(f"Conversation ID: {conversation_id}")
+        print(f"Error: {response}")
+    elif response.status_code == 200:
+        data = orjson.loads(response.content) if orjson else json.loads(response.content)
+
+        print(f"Conversation ID: {conversation_id}")
+        print(f"State: {data.get('state')}")
+        print(f"Created: {data.get('created_at')}")
+        print("\n--- TAGS ---")
+
+        tags = data.get("tags", {}).get("tags", [])
+        if tags:
+            for tag in tags:
+                print(f"  - {tag.get('name')}")
+        else:
+            print("  (No tags)")
+
+        print("\n--- RAW TAG DATA ---")
+        print(data.get("tags"))
     else:
-        print("  (No tags)")
-    
-    print("\n--- RAW TAG DATA ---")
-    print(data.get("tags"))
-else:
-    print(f"Error: {response.status_code}")
-    print(response.text)
\ No newline at end of file
+        print(f"Conversation ID: {conversation_id}")
+        print(f"Error: {response.status_code}")
+        print(response.text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show Intercom tags for one or more conversations")
+    parser.add_argument("conversation_ids", nargs="*", help="Conversation IDs to check")
+    parser.add_argument("--ids", type=str, help="Comma-separated conversation IDs")
+    args = parser.parse_args()
+
+    ids = list(args.conversation_ids)
+    if args.ids:
+        ids.extend(i.strip() for i in args.ids.split(",") if i.strip())
+    if not ids and not sys.stdin.isatty():
+        ids.extend(line.strip() for line in sys.stdin if line.strip())
+    if not ids:
+        parser.error("Provide conversation IDs as arguments, via --ids, or on stdin")
+
+    if not INTERCOM_TOKEN:
+        raise SystemExit("Set INTERCOM_TOKEN environment variable")
+
+    session = create_session()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # map() preserves input order, so output lines up with the IDs given
+        for conversation_id, response in executor.map(lambda cid: fetch_tags(cid, session), ids):
+            print_result(conversation_id, response)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+conversation_parser.py
+
+Pure parsing helpers for Intercom conversations: turn a conversation dict
+into conversation_threads / conversation_messages rows. No network or
+environment access, so the module can be compiled ahead of time:
+
+  mypyc conversation_parser.py
+
+The compiled extension is picked up automatically by
+fetch_conversation_thread.py; without it the plain module is used.
+"""
+
+import json
+import logging
+import importlib
+from datetime import datetime, timezone
+from functools import lru_cache
+from types import ModuleType
+from typing import Any, Dict, Iterator, Optional, Union
+
+# Imported by name so mypy/mypyc type it the same with or without orjson
+orjson: Optional[ModuleType]
+try:
+    orjson = importlib.import_module("orjson")  # optional: faster JSON encode/decode
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# JSON Helpers
+# -----------------------------
+def json_loads(content: Union[bytes, str]) -> Any:
+    """Decode JSON bytes/str with orjson when installed, else the stdlib"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def json_dumps(data: Any) -> str:
+    """Encode compact JSON text with orjson when installed, else the stdlib"""
+    if orjson:
+        encoded: bytes = orjson.dumps(data)
+        return encoded.decode("utf-8")
+    return json.dumps(data, separators=(",", ":"))
+
+# -----------------------------
+# Skip Non-Message Events
+# -----------------------------
+# Event types that are usually just metadata (skip even if they have content)
+_SKIP_PART_TYPES = frozenset({
+    "tag_added",
+    "tag_removed",
+    "close",
+    "open",
+    "snoozed",
+    "unsnoozed",
+    "state_change",
+    "priority_change",
+    "language_detection_details",
+    "custom_answer_applied",
+    "operator_workflow_event",
+    "quick_reply",
+    "conversation_tags_updated",
+    "conversation_attribute_updated_by_admin",
+    "default_assignment"
+})
+
+def should_skip_part(part: Dict[str, Any]) -> bool:
+    """
+    Skip conversation events that aren't actual messages.
+    These are internal events like tag additions, assignments, etc.
+    """
+    part_type = part.get("part_type", "")
+
+    # Metadata events are skipped regardless of content, so test them first
+    if part_type in _SKIP_PART_TYPES:
+        return True
+
+    # Check if part has meaningful content
+    has_content = (
+        part.get("body", "").strip() or
+        part.get("text", "").strip() or
+        part.get("message", "").strip() or
+        (part.get("blocks") and isinstance(part.get("blocks"), list) and len(part.get("blocks", [])) > 0)
+    )
+
+    # Assignment events: skip ONLY if they don't have content
+    # Sometimes agents send a message along with an assignment
+    if part_type == "assignment":
+        if not has_content:
+            return True  # Skip empty assignment events
+        # Keep assignment events that have message content
+        return False
+
+    # Skip if no meaningful content exists
+    if not has_content:
+        logger.debug("Skipping part with no content: %s (type: %s)", part.get("id"), part_type)
+        return True
+
+    return False
+
+# Common internal-note part types; other "note_*" variants are matched by prefix
+_NOTE_TYPES = frozenset({"note", "note_and_reopen"})
+
+# -----------------------------
+# Extract Message Body Helper
+# -----------------------------
+def extract_message_body(part: Dict[str, Any]) -> str:
+    """
+    Extract message body from various Intercom message formats.
+    Bot messages, Fin AI, and regular messages have different structures.
+    """
+    body = part.get("body")
+    text = part.get("text")
+    message = part.get("message")
+    blocks = part.get("blocks")
+
+    # 1. Standard body field (HTML or text)
+    if body:
+        if not isinstance(body, str):
+            body = str(body)
+        if body.strip():
+            return body
+
+    # 2. Text content for bots/automated messages
+    if text:
+        if not isinstance(text, str):
+            text = str(text)
+        if text.strip():
+            return text
+
+    # 3. Message content field
+    if message and isinstance(message, str) and message.strip():
+        return message
+
+    # 4. Blocks content (structured content like cards, buttons)
+    if blocks and isinstance(blocks, list):
+        block_texts = []
+        for block in blocks:
+            get = block.get
+            block_text = get("text") or get("paragraph") or get("heading")
+            if block_text:
+                block_texts.append(block_text)
+        if block_texts:
+            return "\n\n".join(block_texts)
+
+    # If we get here, no content was extracted
+    logger.warning("No body found for part %s (type: %s)",
+                   part.get("id"), part.get("part_type"))
+    logger.debug("Available fields: %s", list(part.keys()))
+
+    return ""
+
+# -----------------------------
+# Parse Conversation Data
+# -----------------------------
+@lru_cache(maxsize=8192)
+def _ts_iso(ts: int) -> str:
+    """Unix timestamp -> UTC ISO string (cached: parts often share timestamps)"""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+def parse_conversation_thread(conversation: Dict[str, Any], raw_text: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Parse Intercom conversation into database format.
+    Pass raw_text (the response body) to store it as full_data without
+    re-serialising the parsed conversation.
+    """
+
+    conv_id = conversation.get("id") or conversation.get("conversation_id")
+
+    # Extract metadata
+    state = conversation.get("state", "unknown")
+    subject = (
+        conversation.get("title") or
+        conversation.get("conversation_message", {}).get("subject") or
+        "No subject"
+    )
+
+    created_at = None
+    if conversation.get("created_at"):
+        created_at = _ts_iso(conversation["created_at"])
+
+    updated_at = None
+    if conversation.get("updated_at"):
+        updated_at = _ts_iso(conversation["updated_at"])
+
+    # Extract customer info
+    contacts = (conversation.get("contacts") or {}).get("contacts") or []
+    customer = contacts[0] if contacts else {}
+    customer_name = customer.get("name") or customer.get("email") or "Unknown"
+    customer_email = customer.get("email")
+
+    # Tags
+    tags = (conversation.get("tags") or {}).get("tags") or []
+    tag_list = [name for tag in tags if (name := tag.get("name"))]
+
+    # Priority
+    priority = conversation.get("priority", "normal")
+
+    thread_data = {
+        "conversation_id": conv_id,
+        "state": state,
+        "subject": subject,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "customer_name": customer_name,
+        "customer_email": customer_email,
+        "tags": json_dumps(tag_list),
+        "priority": priority,
+        "full_data": raw_text if raw_text is not None else json_dumps(conversation),
+        "synced_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    return thread_data
+
+def parse_conversation_messages(conversation: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Extract individual messages from conversation.
+    Generator: yields one message row per part so the writer can buffer and
+    flush without holding a second full list per conversation.
+    """
+
+    conv_id = conversation.get("id") or conversation.get("conversation_id")
+    message_count = 0
+    # One sync timestamp for every message in this conversation
+    synced_at = datetime.now(timezone.utc).isoformat()
+
+    # First message (conversation starter - can be from user or bot)
+    first_message = conversation.get("conversation_message") or conversation.get("source")
+    if first_message and not should_skip_part(first_message):
+        message_body = extract_message_body(first_message)
+        logger.info("First message body length: %d", len(message_body))
+
+        # Only add if we successfully extracted content
+        if message_body and message_body.strip():
+            # Use first_message created_at if available, otherwise fall back to conversation created_at
+            if first_message.get("created_at"):
+                message_created_at = _ts_iso(first_message["created_at"])
+            elif conversation.get("created_at"):
+                # Use conversation created_at as fallback for source messages
+                message_created_at = _ts_iso(conversation["created_at"])
+            else:
+                message_created_at = None
+
+            author = first_message.get("author") or {}
+            msg = {
+                "conversation_id": conv_id,
+                "part_id": first_message.get("id", f"{conv_id}_initial"),
+                "part_type": "comment",
+                "author_type": author.get("type", "user"),
+                "author_id": author.get("id"),
+                "author_name": author.get("name") or author.get("email") or "Customer",
+                "body": message_body,
+                "created_at": message_created_at,
+                "attachments": first_message.get("attachments") or [],
+                "is_note": False,
+                "synced_at": synced_at
+            }
+            message_count += 1
+            yield msg
+        else:
+            logger.info("Skipped first message - no content extracted")
+
+    # Conversation parts (replies, notes, etc.)
+    parts = (conversation.get("conversation_parts") or {}).get("conversation_parts") or []
+    logger.info("Processing %d conversation parts...", len(parts))
+
+    skipped_count = 0
+    for part in parts:
+        # Skip conversation events and parts without content
+        if should_skip_part(part):
+            skipped_count += 1
+            continue
+
+        part_type = part.get("part_type", "comment")
+        author = part.get("author") or {}
+        message_body = extract_message_body(part)
+
+        # Double-check: skip if body extraction failed
+        if not message_body or not message_body.strip():
+            skipped_count += 1
+            continue
+
+        logger.info("Part: %s | Type: %s | Author: %s | Body length: %d",
+                    part.get("id", "unknown"),
+                    part_type,
+                    author.get("name", "Unknown"),
+                    len(message_body))
+
+        # Check if this is an internal note (part_type is 'note' or starts with 'note_')
+        is_note = part_type in _NOTE_TYPES or part_type.startswith("note_")
+
+        msg = {
+            "conversation_id": conv_id,
+            "part_id": part.get("id", f"{conv_id}_{message_count}"),
+            "part_type": part_type,
+            "author_type": author.get("type"),
+            "author_id": author.get("id"),
+            "author_name": author.get("name") or author.get("email") or "Unknown",
+            "body": message_body,
+            "created_at": _ts_iso(part["created_at"]) if part.get("created_at") else None,
+            "attachments": part.get("attachments") or [],
+            "is_note": is_note,
+            "synced_at": synced_at
+        }
+        message_count += 1
+        yield msg
+
+    logger.info("Skipped %d conversation events/empty parts", skipped_count)
+
+    logger.info("Parsed %d messages from conversation", message_count)
@@ -6,19 +6,45 @@ Fetches full conversation threads (messages) from Intercom Conversations API
 Stores in Supabase conversation_threads and conversation_messages tables
 
 Usage:
-  python fetch_conversation_thread.py <conversation_id>
+  python fetch_conversation_thread.py <conversation_id> [<conversation_id> ...]
   python fetch_conversation_thread.py 215471253297267
+  python fetch_conversation_thread.py 215471253297267 215472836676271 --concurrency 10 --batch-size 1000
+  python fetch_conversation_thread.py --updated-since-hours 24
+  python fetch_conversation_thread.py --updated-since-hours 24 --compress-full-data
 """
 
 import os
 import sys
-import json
+import argparse
 import logging
+import queue
+import threading
+import time
 import requests
-from datetime import datetime, timezone
-from supabase import create_client, Client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from dotenv import load_dotenv
-import os
+from intercom_common import RateLimiter
+from conversation_parser import (
+    json_dumps,
+    json_loads,
+    parse_conversation_messages,
+    parse_conversation_thread
+)
+
+try:
+    import psycopg  # optional: COPY path for very large message batches
+    from psycopg.types.json import Jsonb
+except ImportError:
+    psycopg = None
+
+try:
+    import zstandard  # optional: --compress-full-data
+except ImportError:
+    zstandard = None
+
 load_dotenv()  # will load .env in current working directory
 print("INTERCOM_TOKEN in env:", bool(os.environ.get("INTERCOM_TOKEN")))
 
@@ -29,6 +55,8 @@ print("INTERCOM_TOKEN in env:", bool(os.environ.get("INTERCOM_TOKEN")))
 INTERCOM_TOKEN = os.environ.get("INTERCOM_TOKEN")
 SUPABASE_URL = os.environ.get("VITE_SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+# Optional direct Postgres connection string, only used for COPY backfills
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL")
 
 if not INTERCOM_TOKEN:
     raise SystemExit("Set INTERCOM_TOKEN environment variable")
@@ -39,292 +67,251 @@ if not SUPABASE_SERVICE_KEY:
 
 INTERCOM_BASE = "https://api.intercom.io"
 INTERCOM_API_VERSION = "2.14"
+DEFAULT_CONCURRENCY = 10
+SEARCH_PAGE_SIZE = 150  # Intercom's maximum per_page for /conversations/search
+DEFAULT_BATCH_SIZE = 1000
+WRITE_QUEUE_SIZE = 64
+ZSTD_LEVEL = 3
+# conversation_threads rows looked up per request when checking updated_at
+LOOKUP_CHUNK_SIZE = 200
+
+# Message batches larger than this are loaded with COPY when psycopg and
+# SUPABASE_DB_URL are available (raise --batch-size above it for backfills)
+COPY_THRESHOLD = 5000
+MESSAGE_COLUMNS = (
+    "conversation_id", "part_id", "part_type", "author_type", "author_id",
+    "author_name", "body", "created_at", "attachments",
+    "is_note", "synced_at"
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
 # -----------------------------
-# Supabase Client
+# Supabase REST Session
 # -----------------------------
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# Upserts go straight to PostgREST over one keep-alive session
+POSTGREST = f"{SUPABASE_URL.rstrip('/')}/rest/v1/"
+
+supabase_session = requests.Session()
+supabase_session.headers.update({
+    "apikey": SUPABASE_SERVICE_KEY,
+    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+    "Content-Type": "application/json",
+    "Prefer": "resolution=merge-duplicates,return=minimal"
+})
+supabase_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=2))
 
 # -----------------------------
-# Fetch Full Conversation
+# Intercom Session (keep-alive + retries)
 # -----------------------------
-def fetch_conversation_from_intercom(conversation_id: str):
-    """Fetch full conversation thread from Intercom API"""
-    url = f"{INTERCOM_BASE}/conversations/{conversation_id}"
-    headers = {
+def create_intercom_session(pool_size: int = 16) -> requests.Session:
+    """Create a keep-alive Session with Intercom headers and retrying adapter"""
+    session = requests.Session()
+    session.headers.update({
         "Authorization": f"Bearer {INTERCOM_TOKEN}",
         "Accept": "application/json",
         "Intercom-Version": INTERCOM_API_VERSION
-    }
-
-    logger.info("Fetching conversation %s from Intercom...", conversation_id)
-    response = requests.get(url, headers=headers, timeout=30)
-
-    if response.status_code != 200:
-        logger.error("Failed to fetch conversation: %s %s", response.status_code, response.text)
-        response.raise_for_status()
+    })
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        # 429s are retried by rate_limiter.send so every attempt is counted
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "POST"],  # POST is only used for read-only search
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
 
-    conversation = response.json()
-    logger.info("✅ Fetched conversation successfully")
-    return conversation
+intercom_session = create_intercom_session()
 
 # -----------------------------
-# Skip Non-Message Events
+# Rate Limiting
 # -----------------------------
-def should_skip_part(part: dict) -> bool:
+class ConcurrencyController:
     """
-    Skip conversation events that aren't actual messages.
-    These are internal events like tag additions, assignments, etc.
+    AIMD limit on in-flight requests: +0.5 per success, halved whenever
+    Intercom answers 429/5xx (including attempts retried by the adapter or
+    by rate_limiter.send).
     """
-    part_type = part.get("part_type", "")
-
-    # Check if part has meaningful content first
-    has_content = (
-        part.get("body", "").strip() or
-        part.get("text", "").strip() or
-        part.get("message", "").strip() or
-        (part.get("blocks") and isinstance(part.get("blocks"), list) and len(part.get("blocks", [])) > 0)
-    )
 
-    # Event types that are usually just metadata (skip even if they have content)
-    always_skip_types = [
-        "tag_added",
-        "tag_removed",
-        "close",
-        "open",
-        "snoozed",
-        "unsnoozed",
-        "state_change",
-        "priority_change",
-        "language_detection_details",
-        "custom_answer_applied",
-        "operator_workflow_event",
-        "quick_reply",
-        "conversation_tags_updated",
-        "conversation_attribute_updated_by_admin",
-        "default_assignment"
-    ]
-
-    if part_type in always_skip_types:
-        return True
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, response: requests.Response = None, throttled: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled or (response is not None and is_throttled(response)):
+                self.limit = max(1.0, self.limit * 0.5)
+                logger.info("Intercom throttling, concurrency reduced to %d", int(self.limit))
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 0.5)
+            self.condition.notify_all()
 
-    # Assignment events: skip ONLY if they don't have content
-    # Sometimes agents send a message along with an assignment
-    if part_type == "assignment":
-        if not has_content:
-            return True  # Skip empty assignment events
-        # Keep assignment events that have message content
-        return False
-
-    # Skip if no meaningful content exists
-    if not has_content:
-        logger.debug("Skipping part with no content: %s (type: %s)", part.get("id"), part_type)
+def is_throttled(response: requests.Response) -> bool:
+    """True when this response, or an adapter retry behind it, was a 429/5xx"""
+    if response.status_code == 429 or response.status_code >= 500:
         return True
+    retries = getattr(response.raw, "retries", None)
+    history = retries.history if retries else ()
+    return any(h.status and (h.status == 429 or h.status >= 500) for h in history)
 
-    return False
+rate_limiter = RateLimiter()
 
 # -----------------------------
-# Extract Message Body Helper
+# Fetch Full Conversation
 # -----------------------------
-def extract_message_body(part: dict) -> str:
+def fetch_conversation_from_intercom(conversation_id: str, controller: ConcurrencyController = None):
     """
-    Extract message body from various Intercom message formats.
-    Bot messages, Fin AI, and regular messages have different structures.
+    Fetch full conversation thread from Intercom API.
+    Returns (conversation, raw_text) so the raw body can be stored as-is.
     """
-    # 1. Standard body field (HTML or text)
-    if part.get("body") and str(part.get("body")).strip():
-        return str(part.get("body"))
-
-    # 2. Text content for bots/automated messages
-    if part.get("text") and str(part.get("text")).strip():
-        return str(part.get("text"))
-
-    # 3. Message content field
-    if part.get("message") and isinstance(part.get("message"), str) and part.get("message").strip():
-        return part.get("message")
-
-    # 4. Blocks content (structured content like cards, buttons)
-    if part.get("blocks") and isinstance(part.get("blocks"), list):
-        block_texts = []
-        for block in part.get("blocks", []):
-            if block.get("text"):
-                block_texts.append(block.get("text"))
-            elif block.get("paragraph"):
-                block_texts.append(block.get("paragraph"))
-            elif block.get("heading"):
-                block_texts.append(block.get("heading"))
-        if block_texts:
-            return "\n\n".join(block_texts)
-
-    # If we get here, no content was extracted
-    logger.warning("No body found for part %s (type: %s)",
-                   part.get("id"), part.get("part_type"))
-    logger.debug("Available fields: %s", list(part.keys()))
-
-    return ""
-
-# -----------------------------
-# Parse Conversation Data
-# -----------------------------
-def parse_conversation_thread(conversation: dict):
-    """Parse Intercom conversation into database format"""
-
-    conv_id = conversation.get("id") or conversation.get("conversation_id")
-
-    # Extract metadata
-    state = conversation.get("state", "unknown")
-    subject = (
-        conversation.get("title") or
-        conversation.get("conversation_message", {}).get("subject") or
-        "No subject"
-    )
+    url = f"{INTERCOM_BASE}/conversations/{conversation_id}"
 
-    created_at = None
-    if conversation.get("created_at"):
-        created_at = datetime.fromtimestamp(conversation["created_at"], tz=timezone.utc).isoformat()
-
-    updated_at = None
-    if conversation.get("updated_at"):
-        updated_at = datetime.fromtimestamp(conversation["updated_at"], tz=timezone.utc).isoformat()
-
-    # Extract customer info
-    customer = conversation.get("contacts", {}).get("contacts", [{}])[0] if conversation.get("contacts") else {}
-    customer_name = customer.get("name") or customer.get("email") or "Unknown"
-    customer_email = customer.get("email")
-
-    # Tags
-    tags = conversation.get("tags", {}).get("tags", [])
-    tag_list = [tag.get("name") for tag in tags if tag.get("name")]
-
-    # Priority
-    priority = conversation.get("priority", "normal")
-
-    thread_data = {
-        "conversation_id": conv_id,
-        "state": state,
-        "subject": subject,
-        "created_at": created_at,
-        "updated_at": updated_at,
-        "customer_name": customer_name,
-        "customer_email": customer_email,
-        "tags": json.dumps(tag_list),
-        "priority": priority,
-        "full_data": json.dumps(conversation),
-        "synced_at": datetime.now(timezone.utc).isoformat()
-    }
+    logger.info("Fetching conversation %s from Intercom...", conversation_id)
+    if controller:
+        controller.acquire()
+    response = None
+    throttled = False
 
-    return thread_data
+    def get():
+        nonlocal throttled
+        r = intercom_session.get(url, timeout=30)
+        throttled = throttled or r.status_code == 429
+        return r
 
-def parse_conversation_messages(conversation: dict):
-    """Extract individual messages from conversation"""
-
-    conv_id = conversation.get("id") or conversation.get("conversation_id")
-    messages = []
-
-    # First message (conversation starter - can be from user or bot)
-    first_message = conversation.get("conversation_message") or conversation.get("source")
-    if first_message and not should_skip_part(first_message):
-        message_body = extract_message_body(first_message)
-        logger.info("First message body length: %d", len(message_body))
-
-        # Only add if we successfully extracted content
-        if message_body and message_body.strip():
-            # Use first_message created_at if available, otherwise fall back to conversation created_at
-            if first_message.get("created_at"):
-                message_created_at = datetime.fromtimestamp(first_message["created_at"], tz=timezone.utc).isoformat()
-            elif conversation.get("created_at"):
-                # Use conversation created_at as fallback for source messages
-                message_created_at = datetime.fromtimestamp(conversation["created_at"], tz=timezone.utc).isoformat()
-            else:
-                message_created_at = None
-
-            msg = {
-                "conversation_id": conv_id,
-                "part_id": first_message.get("id", f"{conv_id}_initial"),
-                "part_type": "comment",
-                "author_type": first_message.get("author", {}).get("type", "user"),
-                "author_id": first_message.get("author", {}).get("id"),
-                "author_name": first_message.get("author", {}).get("name") or first_message.get("author", {}).get("email") or "Customer",
-                "body": message_body,
-                "body_html": message_body,
-                "created_at": message_created_at,
-                "attachments": json.dumps(first_message.get("attachments", [])),
-                "is_note": False,
-                "synced_at": datetime.now(timezone.utc).isoformat()
-            }
-            messages.append(msg)
-        else:
-            logger.info("Skipped first message - no content extracted")
-
-    # Conversation parts (replies, notes, etc.)
-    parts = conversation.get("conversation_parts", {}).get("conversation_parts", [])
-    logger.info("Processing %d conversation parts...", len(parts))
+    try:
+        response = rate_limiter.send(get)
+    finally:
+        if controller:
+            controller.release(response, throttled)
 
-    skipped_count = 0
-    for part in parts:
-        # Skip conversation events and parts without content
-        if should_skip_part(part):
-            skipped_count += 1
-            continue
+    if response.status_code != 200:
+        logger.error("Failed to fetch conversation: %s %s", response.status_code, response.text)
+        response.raise_for_status()
 
-        part_type = part.get("part_type", "comment")
-        author = part.get("author", {})
-        message_body = extract_message_body(part)
+    conversation = json_loads(response.content)
+    logger.info("✅ Fetched conversation successfully")
+    return conversation, response.text
 
-        # Double-check: skip if body extraction failed
-        if not message_body or not message_body.strip():
-            skipped_count += 1
-            continue
+def fetch_conversations_page(query: dict, starting_after: str = None, per_page: int = SEARCH_PAGE_SIZE):
+    """
+    Fetch one page of conversation shells from POST /conversations/search.
+    Returns (conversations, total_count, next_starting_after).
+    """
+    pagination = {"per_page": per_page}
+    if starting_after:
+        pagination["starting_after"] = starting_after
+
+    response = rate_limiter.send(lambda: intercom_session.post(
+        f"{INTERCOM_BASE}/conversations/search",
+        json={"query": query, "pagination": pagination},
+        timeout=60
+    ))
+    if response.status_code != 200:
+        logger.error("Conversation search failed: %s %s", response.status_code, response.text)
+        response.raise_for_status()
 
-        logger.info("Part: %s | Type: %s | Author: %s | Body length: %d",
-                    part.get("id", "unknown"),
-                    part_type,
-                    author.get("name", "Unknown"),
-                    len(message_body))
-
-        # Check if this is an internal note (part_type is 'note' or starts with 'note_')
-        is_note = part_type == "note" or part_type.startswith("note_")
-
-        msg = {
-            "conversation_id": conv_id,
-            "part_id": part.get("id", f"{conv_id}_{len(messages)}"),
-            "part_type": part_type,
-            "author_type": author.get("type"),
-            "author_id": author.get("id"),
-            "author_name": author.get("name") or author.get("email") or "Unknown",
-            "body": message_body,
-            "body_html": message_body,
-            "created_at": datetime.fromtimestamp(part["created_at"], tz=timezone.utc).isoformat() if part.get("created_at") else None,
-            "attachments": json.dumps(part.get("attachments", [])),
-            "is_note": is_note,
-            "synced_at": datetime.now(timezone.utc).isoformat()
+    data = json_loads(response.content)
+    next_page = (data.get("pages") or {}).get("next") or {}
+    return data.get("conversations", []), data.get("total_count"), next_page.get("starting_after")
+
+def list_updated_conversation_ids(updated_since: int) -> list:
+    """IDs of all conversations updated after the given unix timestamp"""
+    query = {"field": "updated_at", "operator": ">", "value": updated_since}
+    conversation_ids = []
+    starting_after = None
+    while True:
+        conversations, total_count, starting_after = fetch_conversations_page(query, starting_after)
+        if not conversation_ids:
+            logger.info("Search matched %s conversation(s)", total_count)
+        conversation_ids.extend(str(c["id"]) for c in conversations if c.get("id"))
+        if not starting_after:
+            return conversation_ids
+
+def fetch_many(conversation_ids: list, concurrency: int = DEFAULT_CONCURRENCY):
+    """
+    Fetch many conversations concurrently on a thread pool.
+    Yields (conversation_id, (conversation, raw_text), error) as each request completes.
+    """
+    controller = ConcurrencyController(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(fetch_conversation_from_intercom, conversation_id, controller): conversation_id
+            for conversation_id in conversation_ids
         }
-        messages.append(msg)
-
-    logger.info("Skipped %d conversation events/empty parts", skipped_count)
-
-    logger.info("Parsed %d messages from conversation", len(messages))
-    return messages
+        for future in as_completed(futures):
+            conversation_id = futures[future]
+            try:
+                yield conversation_id, future.result(), None
+            except Exception as e:
+                yield conversation_id, None, e
 
 # -----------------------------
 # Store in Supabase
 # -----------------------------
-def store_conversation_thread(thread_data: dict):
-    """Store conversation metadata in conversation_threads table"""
+def upsert_rows(table: str, rows: list, on_conflict: str):
+    """Bulk upsert rows into a table via PostgREST"""
+    response = supabase_session.post(
+        f"{POSTGREST}{table}",
+        params={"on_conflict": on_conflict},
+        data=json_dumps(rows),
+        timeout=120
+    )
+    if response.status_code not in (200, 201, 204):
+        logger.error("Upsert into %s failed: %s %s", table, response.status_code, response.text)
+        response.raise_for_status()
+    return response
+
+def store_conversation_thread(threads: list):
+    """Store conversation metadata rows in conversation_threads table"""
+    if not threads:
+        return
+
     try:
-        response = supabase.table("conversation_threads").upsert(
-            thread_data,
-            on_conflict="conversation_id"
-        ).execute()
-        logger.info("✅ Stored conversation thread metadata")
+        response = upsert_rows("conversation_threads", threads, "conversation_id")
+        logger.info("✅ Stored %d conversation thread(s)", len(threads))
         return response
     except Exception as e:
-        logger.error("Failed to store conversation thread: %s", e)
+        logger.error("Failed to store conversation threads: %s", e)
         raise
 
+def copy_conversation_messages(messages: list):
+    """
+    Upsert messages with COPY into a temp staging table followed by a single
+    INSERT ... ON CONFLICT, bypassing PostgREST's per-row JSON handling.
+    """
+    columns = ", ".join(MESSAGE_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in MESSAGE_COLUMNS if c != "part_id")
+    with psycopg.connect(SUPABASE_DB_URL) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE staging_messages "
+                "(LIKE conversation_messages INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            with cur.copy(f"COPY staging_messages ({columns}) FROM STDIN") as copy:
+                for message in messages:
+                    copy.write_row([
+                        Jsonb(message[c]) if c == "attachments" else message[c]
+                        for c in MESSAGE_COLUMNS
+                    ])
+            cur.execute(
+                f"INSERT INTO conversation_messages ({columns}) "
+                f"SELECT {columns} FROM staging_messages "
+                f"ON CONFLICT (part_id) DO UPDATE SET {updates}"
+            )
+
 def store_conversation_messages(messages: list):
     """Store messages in conversation_messages table"""
     if not messages:
@@ -332,57 +319,272 @@ def store_conversation_messages(messages: list):
         return
 
     try:
-        response = supabase.table("conversation_messages").upsert(
-            messages,
-            on_conflict="part_id"
-        ).execute()
+        if len(messages) > COPY_THRESHOLD and psycopg and SUPABASE_DB_URL:
+            copy_conversation_messages(messages)
+            logger.info("✅ Stored %d messages via COPY", len(messages))
+            return
+        response = upsert_rows("conversation_messages", messages, "part_id")
         logger.info("✅ Stored %d messages", len(messages))
         return response
     except Exception as e:
         logger.error("Failed to store messages: %s", e)
         raise
 
+def fetch_known_updated_at(conversation_ids: list) -> dict:
+    """Map conversation_id -> stored updated_at (epoch seconds) from conversation_threads"""
+    known = {}
+    for start in range(0, len(conversation_ids), LOOKUP_CHUNK_SIZE):
+        chunk = conversation_ids[start:start + LOOKUP_CHUNK_SIZE]
+        response = supabase_session.get(
+            f"{POSTGREST}conversation_threads",
+            params={
+                "select": "conversation_id,updated_at",
+                "conversation_id": f"in.({','.join(chunk)})"
+            },
+            timeout=60
+        )
+        if response.status_code != 200:
+            logger.warning("Could not read stored updated_at: %s %s", response.status_code, response.text)
+            continue
+        for row in json_loads(response.content):
+            try:
+                known[row["conversation_id"]] = datetime.fromisoformat(row["updated_at"]).timestamp()
+            except (TypeError, ValueError):
+                continue  # missing or unparseable: treat as changed
+    return known
+
+def compress_full_data(thread_data: dict, compressor) -> dict:
+    """
+    Move full_data into full_data_zstd as zstd-compressed bytes, hex-encoded
+    the way PostgREST expects bytea values.
+    """
+    full_data = thread_data["full_data"]
+    thread_data["full_data_zstd"] = "\\x" + compressor.compress(full_data.encode("utf-8")).hex()
+    thread_data["full_data"] = None
+    return thread_data
+
+class BatchWriter:
+    """
+    Buffers thread and message rows and upserts them in bulk.
+
+    Full batches are handed to a background thread, so Supabase write
+    latency overlaps with fetching and parsing the next conversations.
+    A single writer thread drains the queue in order, which keeps threads
+    ahead of messages (conversation_messages.conversation_id references
+    conversation_threads). Call close() to drain the queue and surface errors.
+    """
+
+    def __init__(self, flush_threshold: int = DEFAULT_BATCH_SIZE, compress: bool = False):
+        self.flush_threshold = flush_threshold
+        # ZstdCompressor is not thread-safe; it is only used from the caller's thread
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if compress else None
+        self.threads = []
+        self.messages = []
+        self.errors = []
+        self._write_q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._worker = threading.Thread(target=self._writer_loop, daemon=True)
+        self._worker.start()
+
+    def add_thread(self, thread_data: dict):
+        if self.compressor:
+            compress_full_data(thread_data, self.compressor)
+        self.threads.append(thread_data)
+        if len(self.threads) >= self.flush_threshold:
+            self.flush()
+
+    def add_messages(self, messages) -> int:
+        """Buffer messages from any iterable; returns how many were added"""
+        count = 0
+        threshold = self.flush_threshold
+        append = self.messages.append
+        for message in messages:
+            append(message)
+            count += 1
+            if len(self.messages) >= threshold:
+                self.flush()
+                append = self.messages.append  # flush() swaps in a fresh list
+        return count
+
+    def flush(self):
+        """Queue everything buffered so far for the writer thread"""
+        threads, self.threads = self.threads, []
+        messages, self.messages = self.messages, []
+        if threads:
+            self._write_q.put((store_conversation_thread, threads))
+        for start in range(0, len(messages), self.flush_threshold):
+            self._write_q.put((store_conversation_messages, messages[start:start + self.flush_threshold]))
+
+    def close(self):
+        """Flush, wait for all queued writes, and raise the first write error"""
+        self.flush()
+        self._write_q.put(None)
+        self._worker.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def _writer_loop(self):
+        while True:
+            item = self._write_q.get()
+            try:
+                if item is None:
+                    return
+                store, rows = item
+                store(rows)
+            except Exception as e:
+                # store_* already logged it; keep draining so close() can report
+                self.errors.append(e)
+            finally:
+                self._write_q.task_done()
+
 # -----------------------------
 # Main Function
 # -----------------------------
-def fetch_and_store_conversation(conversation_id: str):
+def fetch_and_store_conversation(conversation_id: str, force: bool = False, compress: bool = False):
     """Complete workflow: fetch from Intercom and store in Supabase"""
 
     # Step 1: Fetch from Intercom
-    conversation = fetch_conversation_from_intercom(conversation_id)
+    fetched = fetch_conversation_from_intercom(conversation_id)
+    known_updated_at = None if force else fetch_known_updated_at([conversation_id])
+    writer = BatchWriter(compress=compress)
+    result = store_fetched_conversation(conversation_id, fetched, writer, known_updated_at)
+    writer.close()
+    return result
+
+def store_fetched_conversation(conversation_id: str, fetched: tuple, writer: BatchWriter,
+                               known_updated_at: dict = None):
+    """
+    Parse an already-fetched (conversation, raw_text) pair and queue it on the writer.
+    When known_updated_at is given, conversations whose Intercom updated_at
+    matches the stored row are skipped without parsing.
+    """
+    conversation, raw_text = fetched
+
+    if known_updated_at is not None:
+        stored = known_updated_at.get(conversation_id)
+        if stored is not None and stored == conversation.get("updated_at"):
+            logger.info("Conversation %s unchanged since last sync, skipping", conversation_id)
+            return {
+                "conversation_id": conversation_id,
+                "message_count": 0,
+                "state": conversation.get("state", "unknown"),
+                "subject": conversation.get("title") or "No subject",
+                "skipped": True
+            }
 
     # Step 2: Parse thread metadata
-    thread_data = parse_conversation_thread(conversation)
+    thread_data = parse_conversation_thread(conversation, raw_text)
 
-    # Step 3: Parse messages
+    # Step 3: Parse messages (lazily, consumed by the writer)
     messages = parse_conversation_messages(conversation)
 
-    # Step 4: Store in Supabase
-    store_conversation_thread(thread_data)
-    store_conversation_messages(messages)
+    # Step 4: Queue for Supabase (flushed in batches)
+    writer.add_thread(thread_data)
+    message_count = writer.add_messages(messages)
 
-    logger.info("✅ Successfully fetched and stored conversation %s", conversation_id)
+    logger.info("✅ Successfully fetched and queued conversation %s", conversation_id)
     return {
         "conversation_id": conversation_id,
-        "message_count": len(messages),
+        "message_count": message_count,
         "state": thread_data["state"],
-        "subject": thread_data["subject"]
+        "subject": thread_data["subject"],
+        "skipped": False
     }
 
+def fetch_and_store_many(conversation_ids: list, concurrency: int = DEFAULT_CONCURRENCY,
+                         batch_size: int = DEFAULT_BATCH_SIZE, force: bool = False,
+                         compress: bool = False):
+    """
+    Fetch conversations concurrently, parse each one as it arrives and
+    upsert the rows in batches of batch_size. Conversations unchanged since
+    the last sync are skipped unless force is set.
+    Returns (results, failures) where failures maps conversation_id -> error.
+    """
+    # One batched lookup up front, reused for the whole run
+    known_updated_at = None if force else fetch_known_updated_at(conversation_ids)
+    writer = BatchWriter(batch_size, compress)
+    results = []
+    failures = {}
+    for conversation_id, fetched, error in fetch_many(conversation_ids, concurrency):
+        if error is None:
+            try:
+                results.append(store_fetched_conversation(conversation_id, fetched, writer, known_updated_at))
+                continue
+            except Exception as e:
+                error = e
+        logger.error("Failed to process conversation %s: %s", conversation_id, error)
+        failures[conversation_id] = error
+    writer.close()
+    return results, failures
+
 # -----------------------------
 # CLI Entry Point
 # -----------------------------
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python fetch_conversation_thread.py <conversation_id>")
-        print("Example: python fetch_conversation_thread.py 215471253297267")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Fetch Intercom conversation threads into Supabase")
+    parser.add_argument("conversation_ids", nargs="*", help="Conversation IDs to fetch")
+    parser.add_argument("--updated-since-hours", type=float,
+                        help="Also fetch every conversation updated in the last N hours (via search)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Concurrent Intercom requests (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Rows per Supabase upsert (default: {DEFAULT_BATCH_SIZE}); message "
+                             f"batches over {COPY_THRESHOLD} use COPY when SUPABASE_DB_URL is set")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-store conversations even if updated_at is unchanged")
+    parser.add_argument("--compress-full-data", action="store_true",
+                        help="Store the raw Intercom payload zstd-compressed in full_data_zstd "
+                             "instead of full_data (requires the zstandard package)")
+    args = parser.parse_args()
+
+    if args.compress_full_data and zstandard is None:
+        parser.error("--compress-full-data requires the zstandard package")
+
+    conversation_ids = list(args.conversation_ids)
+    if args.updated_since_hours is not None:
+        updated_since = int(time.time() - args.updated_since_hours * 3600)
+        try:
+            conversation_ids.extend(list_updated_conversation_ids(updated_since))
+        except Exception as e:
+            logger.exception("Failed to list updated conversations: %s", e)
+            sys.exit(1)
+    elif not conversation_ids:
+        parser.error("Provide conversation IDs or --updated-since-hours")
+
+    # dict.fromkeys drops repeated IDs but keeps the order given
+    conversation_ids = list(dict.fromkeys(conversation_ids))
+    if not conversation_ids:
+        print("No conversations to fetch")
+        return
+
+    if len(conversation_ids) > 1:
+        try:
+            results, failures = fetch_and_store_many(conversation_ids, args.concurrency,
+                                                     args.batch_size, args.force,
+                                                     args.compress_full_data)
+        except Exception as e:
+            logger.exception("Failed to store conversations: %s", e)
+            sys.exit(1)
+        skipped = sum(1 for r in results if r["skipped"])
+        print(f"\n✅ Stored {len(results) - skipped} conversation(s), "
+              f"{sum(r['message_count'] for r in results)} message(s)")
+        if skipped:
+            print(f"⏭️  Unchanged (skipped): {skipped}")
+        if failures:
+            print(f"❌ Failed: {len(failures)}")
+            for conversation_id, error in failures.items():
+                print(f"   {conversation_id}: {error}")
+            sys.exit(1)
+        return
 
-    conversation_id = sys.argv[1]
+    conversation_id = conversation_ids[0]
 
     try:
-        result = fetch_and_store_conversation(conversation_id)
-        print(f"\n✅ Success!")
+        result = fetch_and_store_conversation(conversation_id, args.force,
+                                              args.compress_full_data)
+        if result["skipped"]:
+            print("\n⏭️  Unchanged since last sync (use --force to re-store)")
+        else:
+            print(f"\n✅ Success!")
         print(f"Conversation ID: {result['conversation_id']}")
         print(f"Messages: {result['message_count']}")
         print(f"State: {result['state']}")
@@ -0,0 +1,182 @@
+"""
+intercom_common.py
+
+Helpers shared by the Intercom scripts (intercom_supabase_sync.py,
+intercom_cx_export_run.py, fetch_conversation_thread.py,
+check_conversation_tags.py): the Intercom rate limiter and the on-disk
+admin/teammate name cache.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Rate Limiting
+# -----------------------------
+# Intercom allows 1000 requests per minute per app; keep a little headroom
+# and pause early once the server reports less than 10% of the window left.
+INTERCOM_RATE_LIMIT_PER_MINUTE = 950
+INTERCOM_RATE_WINDOW_SECONDS = 60
+INTERCOM_LOW_REMAINING_RATIO = 0.1
+# 429s are retried by RateLimiter.send, not the HTTP adapter, so every
+# attempt is counted against the window
+INTERCOM_MAX_429_RETRIES = 5
+
+
+class RateLimiter:
+    """Sliding-window request counter shared by all request threads"""
+
+    def __init__(self, limit: int = INTERCOM_RATE_LIMIT_PER_MINUTE, window: float = INTERCOM_RATE_WINDOW_SECONDS,
+                 low_remaining_ratio: float = INTERCOM_LOW_REMAINING_RATIO):
+        self.limit = limit
+        self.window = window
+        self.low_remaining_ratio = low_remaining_ratio
+        self.timestamps = deque()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def wait_if_throttled(self):
+        """Block until a request fits in the window, then record it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.timestamps and now - self.timestamps[0] >= self.window:
+                    self.timestamps.popleft()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif len(self.timestamps) >= self.limit:
+                    delay = self.window - (now - self.timestamps[0])
+                else:
+                    self.timestamps.append(now)
+                    return
+            time.sleep(delay)
+
+    def pause(self, delay: float):
+        """Hold every thread for delay seconds"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def observe(self, response: requests.Response):
+        """
+        Pause until the window resets when Intercom reports it is nearly
+        spent, or for Retry-After (at least a second) after a 429.
+        """
+        headers = response.headers
+        if response.status_code == 429:
+            try:
+                delay = float(headers["Retry-After"])
+            except (KeyError, ValueError):
+                try:
+                    delay = int(headers["X-RateLimit-Reset"]) - time.time()
+                except (KeyError, ValueError):
+                    delay = 1.0
+            delay = max(1.0, delay)
+            self.pause(delay)
+            logger.info("Intercom returned 429, pausing %.1fs", delay)
+            return
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            limit = int(headers["X-RateLimit-Limit"])
+            reset_at = int(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        if remaining < limit * self.low_remaining_ratio:
+            delay = max(0.0, reset_at - time.time())
+            self.pause(delay)
+            logger.info("Intercom rate limit low (%d/%d left), pausing %.1fs", remaining, limit, delay)
+
+    def send(self, request: Callable[[], requests.Response],
+             max_retries: int = INTERCOM_MAX_429_RETRIES) -> requests.Response:
+        """
+        Call request() inside the limit, retrying 429s after the pause they
+        trigger. Returns the last response (possibly still a 429).
+        """
+        for attempt in range(max_retries + 1):
+            self.wait_if_throttled()
+            response = request()
+            self.observe(response)
+            if response.status_code != 429 or attempt == max_retries:
+                return response
+
+# -----------------------------
+# Admin/Teammate Name Cache
+# -----------------------------
+# One cache file for every script (override with INTERCOM_ADMINS_CACHE)
+DEFAULT_ADMINS_CACHE_PATH = os.path.expanduser("~/.cache/qa-dashboard/admins.json")
+ADMINS_CACHE_TTL_SECONDS = 3600
+# IDs that /admins could not resolve (team IDs, deleted teammates) are not
+# looked up again until this expires
+ADMIN_MISS_TTL_SECONDS = 24 * 3600
+
+
+class AdminsCache:
+    """
+    {admin_id: name} map fetched from /admins, plus {id: checked_at} for IDs
+    confirmed unresolvable. Freshness is the fetched_at stored in the file.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: float = ADMINS_CACHE_TTL_SECONDS,
+                 miss_ttl_seconds: float = ADMIN_MISS_TTL_SECONDS):
+        # Resolved here, not at import, so callers' load_dotenv() applies
+        self.path = path or os.environ.get("INTERCOM_ADMINS_CACHE", DEFAULT_ADMINS_CACHE_PATH)
+        self.ttl_seconds = ttl_seconds
+        self.miss_ttl_seconds = miss_ttl_seconds
+        self.admins: Dict[str, str] = {}
+        self.misses: Dict[str, int] = {}
+        self.fetched_at = 0
+
+    def load(self) -> "AdminsCache":
+        """Read the file; a stale admins map is dropped, expired misses are pruned"""
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return self
+        now = time.time()
+        if now - cached.get("fetched_at", 0) <= self.ttl_seconds:
+            self.admins = cached.get("admins") or {}
+            self.fetched_at = cached.get("fetched_at", 0)
+        self.misses = {
+            tid: checked_at for tid, checked_at in (cached.get("misses") or {}).items()
+            if now - checked_at <= self.miss_ttl_seconds
+        }
+        return self
+
+    @property
+    def fresh(self) -> bool:
+        return bool(self.admins)
+
+    def set_admins(self, admins_map: Dict[str, str]) -> None:
+        """Replace the map with a full /admins listing fetched just now"""
+        self.admins = dict(admins_map)
+        self.fetched_at = int(time.time())
+        for tid in admins_map:
+            self.misses.pop(tid, None)
+
+    def add_misses(self, ids: Iterable[str]) -> None:
+        now = int(time.time())
+        for tid in ids:
+            self.misses[tid] = now
+
+    def is_known_miss(self, tid: str) -> bool:
+        return tid in self.misses
+
+    def save(self) -> None:
+        """Write atomically so a concurrent run never reads a partial file"""
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"fetched_at": self.fetched_at, "admins": self.admins, "misses": self.misses}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Could not write admins cache %s: %s", self.path, e)
@@ -20,12 +20,19 @@ import zipfile
 import json
 import time
 import re
+import random
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, groupby, islice
 from datetime import datetime, timezone
+from functools import lru_cache
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
+from intercom_common import AdminsCache
 
 # -----------------------------
 # Configuration (from env vars)
@@ -45,6 +52,17 @@ if not SPREADSHEET_ID:
 INTERCOM_BASE = "https://api.intercom.io"
 INTERCOM_API_VERSION = "2.14"
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# Max cells written per values.batchUpdate request
+SHEETS_UPDATE_CELL_LIMIT = 10000
+# Max rows per append/update request, and retries (exponential backoff on 429/5xx)
+SHEETS_APPEND_MAX_ROWS = 5000
+SHEETS_NUM_RETRIES = 5
+
+ADMIN_LOOKUP_WORKERS = 16
+ADMIN_PAGE_WORKERS = 8
+
+# Rows sent to RawData per append while streaming the export
+APPEND_CHUNK_SIZE = 500
 
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -53,6 +71,13 @@ logger = logging.getLogger(__name__)
 # -----------------------------
 # Utility: PII redaction for explanations
 # -----------------------------
+_RE_EMAIL = re.compile(r'[\w\.-]+@[\w\.-]+\.\w+')
+# 6+ digit runs (account numbers); also covers 13-19 digit card numbers
+_RE_NUM6 = re.compile(r'\b\d{6,}\b')
+_RE_PHONE = re.compile(r'(\+?\d[\d\-\s\(\)]{6,}\d)')
+_RE_WS = re.compile(r'\s+')
+_RE_DIGIT = re.compile(r'\d')
+
 def anonymize_text(text: str) -> str:
     """
     Basic PII redaction for explanation text:
@@ -65,31 +90,37 @@ def anonymize_text(text: str) -> str:
     if not text:
         return text
     s = str(text)
-    # redact emails
-    s = re.sub(r'[\w\.-]+@[\w\.-]+\.\w+', '[REDACTED_EMAIL]', s)
-    # redact credit-card-like sequences (13-19 digits)
-    s = re.sub(r'\b\d{13,19}\b', '[REDACTED_NUMBER]', s)
-    # redact sequences of 6+ digits (account numbers)
-    s = re.sub(r'\b\d{6,}\b', '[REDACTED_NUMBER]', s)
-    # redact phone numbers (very permissive)
-    s = re.sub(r'(\+?\d[\d\-\s\(\)]{6,}\d)', '[REDACTED_PHONE]', s)
-    s = re.sub(r'\s+', ' ', s).strip()
+    # Cheap pre-checks: most explanations have no '@' and no digits
+    if '@' in s:
+        s = _RE_EMAIL.sub('[REDACTED_EMAIL]', s)
+    if _RE_DIGIT.search(s):
+        s = _RE_NUM6.sub('[REDACTED_NUMBER]', s)
+        # redact phone numbers (very permissive)
+        s = _RE_PHONE.sub('[REDACTED_PHONE]', s)
+    s = _RE_WS.sub(' ', s).strip()
     return s
 
 # -----------------------------
 # Google Sheets helpers
 # -----------------------------
+@lru_cache(maxsize=1)
 def get_sheets_service():
+    """
+    Build the Sheets client once per process. Uses the discovery document
+    bundled with google-api-python-client instead of fetching it over HTTP.
+    Not thread-safe: callers on different threads must not use it concurrently.
+    """
     creds = Credentials.from_service_account_file(SA_PATH, scopes=SCOPES)
-    return build("sheets", "v4", credentials=creds)
+    return build("sheets", "v4", credentials=creds, static_discovery=True, cache_discovery=False)
 
 def ensure_rawdata_sheet(sheet_service):
+    """Create RawData with its header row if missing; returns the sheet's grid row count"""
     sheets_api = sheet_service.spreadsheets()
-    spreadsheet = sheets_api.get(spreadsheetId=SPREADSHEET_ID).execute()
-    sheet_titles = [s["properties"]["title"] for s in spreadsheet.get("sheets", [])]
-    if "RawData" not in sheet_titles:
+    spreadsheet = sheets_api.get(spreadsheetId=SPREADSHEET_ID, fields="sheets.properties").execute()
+    sheet_props = {s["properties"]["title"]: s["properties"] for s in spreadsheet.get("sheets", [])}
+    if "RawData" not in sheet_props:
         requests_body = {"requests": [{"addSheet": {"properties": {"title": "RawData"}}}]}
-        sheets_api.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=requests_body).execute()
+        reply = sheets_api.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=requests_body).execute()
         logger.info("Created sheet 'RawData'.")
         header = [
             "date", "agent", "score", "conversation_id", "cx_score_breakdown",
@@ -103,34 +134,104 @@ def ensure_rawdata_sheet(sheet_service):
             body={"values": [header]}
         ).execute()
         logger.info("Header row set in RawData (A1:K1).")
+        props = reply["replies"][0]["addSheet"]["properties"]
     else:
         logger.info("'RawData' sheet already exists.")
+        props = sheet_props["RawData"]
+    return props.get("gridProperties", {}).get("rowCount")
 
 def load_existing_conversation_ids(sheet_service):
+    """Return (existing conversation IDs, first empty row) from RawData column D"""
     try:
-        res = sheet_service.spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range="RawData!D2:D1000000").execute()
-        vals = res.get("values", [])
-        return set(r[0] for r in vals if r and r[0])
+        # COLUMNS major returns column D as one flat list: [[id, id, ...]]
+        res = sheet_service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID, range="RawData!D2:D", majorDimension="COLUMNS"
+        ).execute()
+        vals = res.get("values") or [[]]
+        column = vals[0]
+        return set(filter(None, column)), len(column) + 2
     except Exception as e:
         logger.warning("Failed to load existing conversation IDs: %s", e)
-        return set()
+        return set(), None
 
-def append_rows(sheet_service, rows):
+def append_rows(sheet_service, rows, position=None):
+    """
+    Write rows after the last used row of RawData, at most
+    SHEETS_APPEND_MAX_ROWS per request so large runs stay under the Sheets
+    payload limits. Each request retries 429/5xx with exponential backoff.
+    position is {"next_row": int, "grid_rows": int}: when a chunk fits in
+    the existing grid and the target A:K range is confirmed empty, it is
+    written with values.update at next_row, which skips the table search
+    values.append does server-side. Otherwise (or without a known position)
+    values.append with INSERT_ROWS grows the grid.
+    """
     if not rows:
         logger.info("No rows to append.")
         return
-    sheet_service.spreadsheets().values().append(
-        spreadsheetId=SPREADSHEET_ID,
-        range="RawData!A2",
-        valueInputOption="RAW",
-        insertDataOption="INSERT_ROWS",
-        body={"values": rows}
-    ).execute()
+    for start in range(0, len(rows), SHEETS_APPEND_MAX_ROWS):
+        _write_rows(sheet_service, rows[start:start + SHEETS_APPEND_MAX_ROWS], position)
     logger.info("Appended %d rows to RawData.", len(rows))
 
+def _range_is_empty(values_api, first_row, last_row):
+    """True if RawData!A:K holds no values between first_row and last_row"""
+    res = values_api.get(
+        spreadsheetId=SPREADSHEET_ID, range=f"RawData!A{first_row}:K{last_row}"
+    ).execute(num_retries=SHEETS_NUM_RETRIES)
+    return not res.get("values")
+
+def _write_rows(sheet_service, rows, position):
+    values_api = sheet_service.spreadsheets().values()
+    next_row = position and position.get("next_row")
+    grid_rows = position and position.get("grid_rows")
+    last_row = next_row + len(rows) - 1 if next_row else None
+    use_update = bool(next_row and grid_rows and last_row <= grid_rows)
+    if use_update and not _range_is_empty(values_api, next_row, last_row):
+        # Column D under-counted the used rows (e.g. rows with a blank ID);
+        # stop trusting next_row and let append find the end of the table
+        logger.warning("RawData rows %d-%d are not empty; appending instead.", next_row, last_row)
+        position["next_row"] = next_row = None
+        use_update = False
+    if use_update:
+        values_api.update(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f"RawData!A{next_row}",
+            valueInputOption="RAW",
+            body={"values": rows}
+        ).execute(num_retries=SHEETS_NUM_RETRIES)
+    else:
+        values_api.append(
+            spreadsheetId=SPREADSHEET_ID,
+            range="RawData!A2",
+            valueInputOption="RAW",
+            insertDataOption="INSERT_ROWS",
+            body={"values": rows}
+        ).execute(num_retries=SHEETS_NUM_RETRIES)
+        if grid_rows:
+            position["grid_rows"] = grid_rows + len(rows)
+    if next_row:
+        position["next_row"] = next_row + len(rows)
+
 # -----------------------------
 # Intercom reporting export helpers
 # -----------------------------
+# Shared keep-alive session for every Intercom call. Retries connection
+# errors and 429/5xx on GETs with backoff, sleeping for Retry-After when
+# Intercom sends it. Auth and version headers are set once here.
+_session = requests.Session()
+_session.headers.update({
+    "Authorization": f"Bearer {INTERCOM_TOKEN}",
+    "Intercom-Version": INTERCOM_API_VERSION,
+    "Accept": "application/json"
+})
+_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False
+)))
+
 def enqueue_export(start_time_unix: int, end_time_unix: int, attribute_ids: list):
     url = f"{INTERCOM_BASE}/export/reporting_data/enqueue"
     payload = {
@@ -139,13 +240,7 @@ def enqueue_export(start_time_unix: int, end_time_unix: int, attribute_ids: list
         "start_time": int(start_time_unix),
         "end_time": int(end_time_unix)
     }
-    headers = {
-        "Authorization": f"Bearer {INTERCOM_TOKEN}",
-        "Content-Type": "application/json",
-        "Intercom-Version": INTERCOM_API_VERSION,
-        "Accept": "application/json"
-    }
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
+    r = _session.post(url, json=payload, timeout=60)
     if r.status_code != 200:
         logger.error("Enqueue failed. status=%s body=%s", r.status_code, r.text)
         r.raise_for_status()
@@ -159,12 +254,12 @@ def enqueue_export(start_time_unix: int, end_time_unix: int, attribute_ids: list
 
 def poll_export(job_identifier: str, max_wait_seconds: int = 600):
     url = f"{INTERCOM_BASE}/export/reporting_data/{job_identifier}"
-    headers = {"Authorization": f"Bearer {INTERCOM_TOKEN}", "Intercom-Version": INTERCOM_API_VERSION, "Accept": "application/json"}
     start = time.time()
-    delay = 5
+    # Start short so fast jobs return quickly; grow with decorrelated jitter
+    delay = random.uniform(1.0, 2.0)
     while True:
         params = {"app_id": INTERCOM_APP_ID} if INTERCOM_APP_ID else None
-        r = requests.get(url, headers=headers, params=params, timeout=30)
+        r = _session.get(url, params=params, timeout=30)
         if r.status_code != 200:
             logger.error("Poll status failed: %s %s", r.status_code, r.text)
             r.raise_for_status()
@@ -182,7 +277,7 @@ def poll_export(job_identifier: str, max_wait_seconds: int = 600):
             logger.error("Timed out waiting for job %s after %s seconds", job_identifier, max_wait_seconds)
             raise TimeoutError("Timed out waiting for export job")
         time.sleep(delay)
-        delay = min(60, delay * 2)
+        delay = min(60, random.uniform(delay, delay * 3))
 
 def download_export(job_response: dict, job_identifier: str):
     """
@@ -190,10 +285,13 @@ def download_export(job_response: dict, job_identifier: str):
       1) Try job_response['download_url'] with application/octet-stream + Authorization
       2) Retry download_url with Accept: */* and no Authorization (some presigned URLs require this)
       3) Fallback to /download/reporting_data/{job_identifier}?app_id=...
+    Returns the open streaming response; the body is read by iter_export_rows.
     """
     def try_get(url, headers=None, params=None, allow_redirects=True):
         try:
-            r = requests.get(url, headers=headers or {}, params=params, timeout=120, allow_redirects=allow_redirects)
+            r = _session.get(url, headers=headers or {}, params=params, timeout=120, allow_redirects=allow_redirects, stream=True)
+            if r.status_code != 200:
+                r.close()
             return r.status_code, r
         except Exception as e:
             return None, e
@@ -201,22 +299,23 @@ def download_export(job_response: dict, job_identifier: str):
     download_url = job_response.get("download_url")
     if download_url:
         logger.info("Attempting download_url with application/octet-stream")
-        headers = {"Authorization": f"Bearer {INTERCOM_TOKEN}", "Accept": "application/octet-stream"}
+        # A None value drops the session default for this request
+        headers = {"Accept": "application/octet-stream", "Intercom-Version": None}
         status, resp = try_get(download_url, headers=headers)
         if isinstance(resp, requests.models.Response) and resp.status_code == 200:
             logger.info("Downloaded from download_url (application/octet-stream).")
-            return resp.content
+            return resp
         if isinstance(resp, requests.models.Response):
             logger.warning("download_url returned status=%s. Trying permissive fallback...", resp.status_code)
         else:
             logger.warning("download_url attempt raised: %s", resp)
 
         logger.info("Retrying download_url with Accept: */* and no Authorization header")
-        headers2 = {"Accept": "*/*"}
+        headers2 = {"Accept": "*/*", "Authorization": None, "Intercom-Version": None}
         status2, resp2 = try_get(download_url, headers=headers2)
         if isinstance(resp2, requests.models.Response) and resp2.status_code == 200:
             logger.info("Downloaded from download_url (fallback headers).")
-            return resp2.content
+            return resp2
         if isinstance(resp2, requests.models.Response):
             logger.warning("Fallback download_url attempt returned status=%s", resp2.status_code)
         else:
@@ -224,182 +323,250 @@ def download_export(job_response: dict, job_identifier: str):
 
     logger.info("Falling back to /download/reporting_data/{job_id} endpoint with app_id param")
     download_endpoint = f"{INTERCOM_BASE}/download/reporting_data/{job_identifier}"
-    headers3 = {"Authorization": f"Bearer {INTERCOM_TOKEN}", "Accept": "application/octet-stream", "Intercom-Version": INTERCOM_API_VERSION}
+    headers3 = {"Accept": "application/octet-stream"}
     params = {"app_id": INTERCOM_APP_ID, "job_identifier": job_identifier}
     status3, resp3 = try_get(download_endpoint, headers=headers3, params=params)
     if isinstance(resp3, requests.models.Response) and resp3.status_code == 200:
         logger.info("Downloaded from /download/reporting_data endpoint.")
-        return resp3.content
+        return resp3
 
     logger.error("All download attempts failed. Job response: %s", json.dumps(job_response, indent=2)[:4000])
     if isinstance(resp3, requests.models.Response):
-        logger.error("Final download attempt returned %s: %s", resp3.status_code, resp3.text[:2000])
+        logger.error("Final download attempt returned %s", resp3.status_code)
         resp3.raise_for_status()
     raise RuntimeError("Download failed and no usable HTTP response available.")
 
-def parse_export_bytes(content_bytes: bytes):
+def iter_export_rows(response: requests.Response):
     """
-    Try gzip, zip, then plain CSV. Return list of dicts.
+    Detect gzip, zip, or plain CSV from the first bytes of a streaming
+    download and yield dict rows while the body is still arriving.
     """
-    # gzip
-    try:
-        if content_bytes[:2] == b'\x1f\x8b':
-            with gzip.GzipFile(fileobj=io.BytesIO(content_bytes)) as gz:
-                text = gz.read().decode("utf-8")
-                return list(csv.DictReader(io.StringIO(text)))
-    except Exception:
-        pass
-    # zip
+    # decode_content undoes any transport Content-Encoding, leaving the file bytes
+    response.raw.decode_content = True
+    raw = io.BufferedReader(response.raw)
+    # peek() does not consume; it may return more than 4 bytes
+    head = raw.peek(4)
+    if head.startswith(b'\x1f\x8b'):
+        stream = gzip.GzipFile(fileobj=raw)
+    elif head.startswith(b'PK\x03\x04'):
+        # zip needs random access to its central directory, so buffer this format
+        z = zipfile.ZipFile(io.BytesIO(raw.read()))
+        stream = z.open(z.namelist()[0])
+    else:
+        stream = raw
     try:
-        if content_bytes[:4] == b'PK\x03\x04':
-            z = zipfile.ZipFile(io.BytesIO(content_bytes))
-            name = z.namelist()[0]
-            with z.open(name) as f:
-                text = f.read().decode("utf-8")
-                return list(csv.DictReader(io.StringIO(text)))
-    except Exception:
-        pass
-    # plain CSV fallback
-    text = content_bytes.decode("utf-8")
-    return list(csv.DictReader(io.StringIO(text)))
+        with io.TextIOWrapper(stream, encoding="utf-8", newline="") as text:
+            yield from csv.DictReader(text)
+    finally:
+        response.close()
 
 # -----------------------------
 # Map / normalize rows
 # -----------------------------
-def map_row_to_canonical(row: dict, attr_map: dict):
+# Header token scans, one regex pass per header instead of one substring test per token
+_SCORE_DETECT_RE = re.compile(r"ai_cx|cx_score|conversation_cx|fin_ai|lastrating|rating", re.I)
+_EXPL_DETECT_RE = re.compile(r"explain|breakdown", re.I)  # also matches "explanation"
+_AGENT_TOK_RE = re.compile(r"assignee|teammate|agent|owner", re.I)
+_SCORE_TOK_RE = re.compile(r"cx|score|rating", re.I)
+_EXPL_TOK_RE = re.compile(r"explain|breakdown|reason", re.I)
+
+def _dedupe(cols):
+    """Drop empty and repeated column names, keeping order"""
+    return list(dict.fromkeys(c for c in cols if c))
+
+def build_header_plan(headers: list, attr_map: dict) -> dict:
     """
-    Return [date_iso, agent, final_score, conversation_id]
+    Resolve, once per export, which columns map_row_to_canonical and the
+    explanation lookup should read. Auto-detects the CX score and
+    explanation columns into attr_map. Each *_cols entry lists the
+    candidate columns in priority order; rows take the first non-empty one.
     """
-    # Timestamp
-    ts = None
-    for tkey in ("conversation_last_closed_at", "conversation_started_at"):
-        mapped = attr_map.get(tkey)
-        if mapped and row.get(mapped):
-            ts = row.get(mapped)
-            break
-    if not ts:
-        ts = row.get("conversation_last_closed_at") or row.get("conversation_started_at") or ""
+    # Auto-detect CX score & explanation columns (if present)
+    if headers:
+        # detect score column
+        if attr_map.get("cx_score") is None:
+            for h in headers:
+                if _SCORE_DETECT_RE.search(h):
+                    attr_map["cx_score"] = h
+                    logger.info("Auto-detected CX score column: %s", h)
+                    break
+        # detect explanation column
+        if attr_map.get("cx_explanation") is None:
+            for h in headers:
+                # only fields with explanation/breakdown keywords
+                if _EXPL_DETECT_RE.search(h):
+                    attr_map["cx_explanation"] = h
+                    logger.info("Auto-detected CX explanation column: %s", h)
+                    break
 
-    date_iso = ""
-    try:
-        ts_i = int(ts)
-        date_iso = datetime.fromtimestamp(ts_i, tz=timezone.utc).isoformat()
-    except Exception:
-        date_iso = ts or ""
+    keys_lower = {h.lower(): h for h in headers}
+
+    # Timestamp
+    ts_cols = _dedupe([
+        attr_map.get("conversation_last_closed_at"), attr_map.get("conversation_started_at"),
+        "conversation_last_closed_at", "conversation_started_at"
+    ])
 
-    # Agent detection (teammate id or name)
-    agent = None
+    # Agent detection (teammate id or name): known fields, then any assignee-like header
     possible_agent_fields = [
         attr_map.get("assignee_name"),
         "currently_assigned_teammate_id", "currently_assigned_teammate_raw_id",
         "currently_assigned_team_id", "assignee_id", "assignee", "assignee_user_id",
         "last_rated_teammate_raw_id", "reply_participant_teammate_ids"
     ]
-    keys_lower = {k.lower(): k for k in row.keys()}
-    for f in possible_agent_fields:
-        if not f:
-            continue
-        fk = f.lower()
-        if fk in keys_lower:
-            val = row.get(keys_lower[fk])
-            if val not in (None, ""):
-                agent = val
-                break
-    if not agent:
-        for k in row.keys():
-            kl = k.lower()
-            if any(tok in kl for tok in ("assignee", "teammate", "agent", "owner")) and row.get(k):
-                agent = row.get(k)
-                break
-    agent = agent or "Unknown"
-
-    # Score detection
+    agent_cols = _dedupe(keys_lower.get(f.lower()) for f in possible_agent_fields if f)
+    agent_cols += [h for h in headers if h not in agent_cols
+                   and _AGENT_TOK_RE.search(h)]
+
+    # Score detection: known fields (exact or case-insensitive), then any score-like header
     candidates = [
         attr_map.get("cx_score"),
         "ai_cx_score_rating", "conversation_rating", "fin_ai_agent_rating",
         "lastRatingValue", "totalRatings", "last_teammate_rating"
     ]
-    score = None
+    score_cols = []
     for c in candidates:
-        if not c:
-            continue
-        if c in row and row.get(c) not in (None, ""):
-            score = row.get(c)
-            break
-        if c.lower() in keys_lower and row.get(keys_lower[c.lower()]) not in (None, ""):
-            score = row.get(keys_lower[c.lower()])
-            break
-    if not score:
-        for k in row.keys():
-            if any(s in k.lower() for s in ("cx", "score", "rating")) and row.get(k) not in (None, ""):
-                score = row.get(k)
-                break
+        if c:
+            score_cols += [c if c in keys_lower.values() else None, keys_lower.get(c.lower())]
+    score_cols = _dedupe(score_cols)
+    score_cols += [h for h in headers if h not in score_cols
+                   and _SCORE_TOK_RE.search(h)]
+
+    # Explanation: detected column, then any explanation-like header
+    explanation_cols = _dedupe([attr_map.get("cx_explanation")] + [
+        h for h in headers
+        if _EXPL_TOK_RE.search(h)
+    ])
+
+    return {
+        "ts_cols": ts_cols,
+        "agent_cols": agent_cols,
+        "score_cols": score_cols,
+        "explanation_cols": explanation_cols,
+        "conv_id_cols": _dedupe([attr_map.get("conversation_id"), "conversation_id"]),
+    }
 
-    def percent_to_1_5(v):
-        try:
-            f = float(v)
-            if 0 <= f <= 100:
-                return int(round(1 + 4 * (f / 100.0)))
-        except Exception:
-            pass
-        return None
+def first_value(row: dict, cols: list):
+    """First non-empty value among cols, else None"""
+    for c in cols:
+        val = row.get(c)
+        if val not in (None, ""):
+            return val
+    return None
+
+def map_row_to_canonical(row: dict, plan: dict):
+    """
+    Return [date_iso, agent, final_score, conversation_id]
+    """
+    # Timestamp
+    ts = first_value(row, plan["ts_cols"]) or ""
+
+    date_iso = ""
+    try:
+        ts_i = int(ts)
+        date_iso = datetime.fromtimestamp(ts_i, tz=timezone.utc).isoformat()
+    except Exception:
+        date_iso = ts or ""
+
+    agent = first_value(row, plan["agent_cols"]) or "Unknown"
+    score = first_value(row, plan["score_cols"])
 
     final_score = ""
     if score not in (None, ""):
         try:
             f = float(score)
-            if 1 <= f <= 5:
-                final_score = round(f, 2)
-            elif 0 <= f <= 100:
-                conv = percent_to_1_5(f)
-                final_score = conv if conv is not None else round(f, 2)
+        except (TypeError, ValueError):
+            final_score = str(score)
+        else:
+            # 1-5 is already on the target scale; other 0-100 values are percentages
+            if 0 <= f <= 100 and not 1 <= f <= 5:
+                final_score = int(round(1 + 4 * (f / 100.0)))
             else:
                 final_score = round(f, 2)
-        except Exception:
-            final_score = str(score)
 
-    conv_id = row.get(attr_map.get("conversation_id") or "conversation_id") or row.get("conversation_id") or ""
+    conv_id = first_value(row, plan["conv_id_cols"]) or ""
     return [date_iso, agent, final_score, conv_id]
 
 # -----------------------------
 # Admins resolution (enrichment)
 # -----------------------------
+# Numeric IDs, or hex/UUID-like IDs of 8+ characters
+_TID_RE = re.compile(r"\d+|[0-9a-fA-F\-]{8,}")
+
 def looks_like_teammate_id(s):
     if not s or s == "Unknown":
         return False
-    s = str(s).strip()
-    if re.fullmatch(r"\d+", s):
-        return True
-    if re.fullmatch(r"[0-9a-fA-F\-]{8,}", s):
-        return True
-    return False
+    return _TID_RE.fullmatch(str(s).strip()) is not None
+
+def add_admins(admins_map, data):
+    """Merge one /admins response page into admins_map"""
+    admin_list = data.get("admins") or data.get("data") or []
+    for a in admin_list:
+        aid = a.get("id") or a.get("admin_id") or a.get("user_id")
+        name = a.get("name") or a.get("email") or str(aid)
+        if aid:
+            admins_map[str(aid)] = name
+
+def fetch_admins_page(url, params=None):
+    """GET one page of /admins; returns the decoded body or None on failure"""
+    r = _session.get(url, params=params, timeout=30)
+    if r.status_code != 200:
+        logger.warning("Failed to fetch admins list: %s %s", r.status_code, r.text[:500])
+        return None
+    return r.json()
 
 def fetch_all_admins_map():
     admins_map = {}
     url = f"{INTERCOM_BASE}/admins"
-    headers = {"Authorization": f"Bearer {INTERCOM_TOKEN}", "Accept": "application/json"}
-    params = {"per_page": 50}
-    while True:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
-        if r.status_code != 200:
-            logger.warning("Failed to fetch admins list: %s %s", r.status_code, r.text[:500])
+    data = fetch_admins_page(url, {"per_page": 50})
+    if data is None:
+        return admins_map
+    add_admins(admins_map, data)
+    pages = data.get("pages") or {}
+
+    # Page 1 tells us how many pages exist: fetch the rest concurrently
+    total_pages = pages.get("total_pages")
+    if isinstance(total_pages, int) and total_pages > 1:
+        page_params = [{"per_page": 50, "page": p} for p in range(2, total_pages + 1)]
+        with ThreadPoolExecutor(max_workers=ADMIN_PAGE_WORKERS) as executor:
+            for page in executor.map(lambda params: fetch_admins_page(url, params), page_params):
+                if page is not None:
+                    add_admins(admins_map, page)
+        return admins_map
+
+    # Otherwise follow next links one page at a time
+    next_url = pages.get("next")
+    while next_url:
+        data = fetch_admins_page(next_url)
+        if data is None:
             break
-        data = r.json()
-        admin_list = data.get("admins") or data.get("data") or []
-        for a in admin_list:
-            aid = a.get("id") or a.get("admin_id") or a.get("user_id")
-            name = a.get("name") or a.get("email") or str(aid)
-            if aid:
-                admins_map[str(aid)] = name
-        pages = data.get("pages") or {}
-        next_url = pages.get("next")
-        if next_url:
-            url = next_url
-            params = None
-            continue
-        break
+        add_admins(admins_map, data)
+        next_url = (data.get("pages") or {}).get("next")
     return admins_map
 
+def contiguous_runs(row_nums):
+    """Yield (first_row, last_row) for each run of consecutive row numbers"""
+    for _, group in groupby(enumerate(sorted(row_nums)), key=lambda p: p[1] - p[0]):
+        group = list(group)
+        yield group[0][1], group[-1][1]
+
+def fetch_admin_name(tid):
+    """
+    GET /admins/{tid}; returns the name/email, "" when Intercom has no such
+    admin (404), or None if the lookup failed
+    """
+    try:
+        r = _session.get(f"{INTERCOM_BASE}/admins/{tid}", timeout=10)
+        if r.status_code == 200:
+            jr = r.json()
+            return jr.get("name") or jr.get("email") or tid
+        if r.status_code == 404:
+            return ""
+        logger.debug("GET /admins/%s returned %s", tid, r.status_code)
+    except Exception as e:
+        logger.warning("Failed to fetch admin %s: %s", tid, e)
+    return None
+
 def resolve_teammate_ids_and_update_sheet():
     svc = get_sheets_service()
     res = svc.spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range="RawData!A2:D10000").execute()
@@ -421,41 +588,114 @@ def resolve_teammate_ids_and_update_sheet():
         return
 
     logger.info("Need to resolve %d unique teammate IDs", len(id_to_rows))
-    admins_map = fetch_all_admins_map()
+
+    # Warm from disk (shared with intercom_supabase_sync.py); only hit the
+    # admins list when the cache can't cover every ID. IDs that recently
+    # 404'd are left as-is until the miss TTL expires.
+    cache = AdminsCache().load()
+    admins_map = dict(cache.admins)
+    unknown = [tid for tid in id_to_rows if tid not in admins_map and not cache.is_known_miss(tid)]
+    refreshed = False
+    if unknown:
+        fetched = fetch_all_admins_map()
+        refreshed = bool(fetched)
+        admins_map.update(fetched)
+
+    # Remaining IDs are usually non-admin teammates/teams: look them up in parallel
+    missing = [tid for tid in unknown if tid not in admins_map]
+    not_found = []
+    if missing:
+        logger.info("Looking up %d IDs not in the admins list", len(missing))
+        with ThreadPoolExecutor(max_workers=ADMIN_LOOKUP_WORKERS) as executor:
+            for tid, name in zip(missing, executor.map(fetch_admin_name, missing)):
+                if name:
+                    admins_map[tid] = name
+                elif name == "":
+                    not_found.append(tid)
+    if refreshed:
+        cache.set_admins(admins_map)
+    if not_found:
+        logger.info("%d IDs could not be resolved; skipping them for now", len(not_found))
+        cache.add_misses(not_found)
+    if refreshed or not_found:
+        cache.save()
 
     updates = []
     for tid, row_nums in id_to_rows.items():
-        name = admins_map.get(tid)
-        if not name:
-            try:
-                r = requests.get(f"{INTERCOM_BASE}/admins/{tid}", headers={"Authorization": f"Bearer {INTERCOM_TOKEN}", "Accept": "application/json"}, timeout=10)
-                if r.status_code == 200:
-                    jr = r.json()
-                    name = jr.get("name") or jr.get("email") or tid
-                    admins_map[tid] = name
-                else:
-                    logger.debug("GET /admins/%s returned %s", tid, r.status_code)
-                    name = tid
-            except Exception as e:
-                logger.warning("Failed to fetch admin %s: %s", tid, e)
-                name = tid
-
-        for rnum in row_nums:
-            updates.append({"range": f"RawData!B{rnum}", "values": [[name]]})
-
-    if updates:
-        svc.spreadsheets().values().batchUpdate(spreadsheetId=SPREADSHEET_ID, body={"valueInputOption":"RAW", "data": updates}).execute()
-        logger.info("Updated %d agent name cells in RawData.", len(updates))
-    else:
+        name = admins_map.get(tid) or tid
+
+        # One range per block of consecutive rows instead of one per cell
+        for first, last in contiguous_runs(row_nums):
+            updates.append({"range": f"RawData!B{first}:B{last}", "values": [[name]] * (last - first + 1)})
+
+    if not updates:
         logger.info("No updates needed for agent names.")
+        return
+
+    # Split into requests of at most SHEETS_UPDATE_CELL_LIMIT cells
+    batch, batch_cells, total_cells = [], 0, 0
+    for update in updates:
+        cells = len(update["values"])
+        if batch and batch_cells + cells > SHEETS_UPDATE_CELL_LIMIT:
+            svc.spreadsheets().values().batchUpdate(spreadsheetId=SPREADSHEET_ID, body={"valueInputOption":"RAW", "data": batch}).execute()
+            batch, batch_cells = [], 0
+        batch.append(update)
+        batch_cells += cells
+        total_cells += cells
+    svc.spreadsheets().values().batchUpdate(spreadsheetId=SPREADSHEET_ID, body={"valueInputOption":"RAW", "data": batch}).execute()
+    logger.info("Updated %d agent name cells in RawData (%d ranges).", total_cells, len(updates))
 
 # -----------------------------
 # Main workflow
 # -----------------------------
-def run_window(start_unix: int, end_unix: int):
+def iter_canonical_rows(rows, plan, attr_map, existing_ids, job_id, exported_at):
+    """
+    Yield one RawData row per new conversation in the export.
+    Adds each yielded conversation_id to existing_ids to drop repeats.
+    """
+    downloaded = 0
+    for r in rows:
+        downloaded += 1
+        conv_id = r.get("conversation_id") or r.get("id") or r.get(attr_map.get("conversation_id")) or ""
+        if not conv_id:
+            continue
+        if conv_id in existing_ids:
+            continue
+        mapped = map_row_to_canonical(r, plan)
+        try:
+            explanation = first_value(r, plan["explanation_cols"])
+            cx_breakdown = anonymize_text(explanation) if explanation else ""
+        except Exception:
+            cx_breakdown = ""
+
+        existing_ids.add(conv_id)
+        yield [
+            mapped[0] or "",
+            mapped[1] or "",
+            mapped[2] if mapped[2] != "" else "",
+            mapped[3] or "",
+            cx_breakdown,
+            job_id,
+            exported_at,
+            "", "", "", ""
+        ]
+    logger.info("Downloaded %d rows from Intercom export.", downloaded)
+
+def prepare_rawdata_sheet():
+    """Sheets setup for a run: ensure RawData exists and read the existing IDs"""
+    # The only Sheets user while the export job runs; the main thread
+    # touches the shared client only after this has finished
     svc = get_sheets_service()
-    ensure_rawdata_sheet(svc)
+    grid_rows = ensure_rawdata_sheet(svc)
+    existing_ids, next_row = load_existing_conversation_ids(svc)
+    return grid_rows, existing_ids, next_row
+
+def run_export_job(start_unix: int, end_unix: int, attribute_ids: list):
+    """Enqueue the reporting export and wait for it; returns (job_id, job_response)"""
+    job_id, enqueue_resp = enqueue_export(start_unix, end_unix, attribute_ids)
+    return job_id, poll_export(job_id)
 
+def run_window(start_unix: int, end_unix: int):
     attribute_ids = [
         "conversation_id",
         "conversation_started_at",
@@ -476,14 +716,22 @@ def run_window(start_unix: int, end_unix: int):
     ]
 
     logger.info("Enqueue payload attribute_ids: %s", attribute_ids)
-    job_id, enqueue_resp = enqueue_export(start_unix, end_unix, attribute_ids)
-
-    job_resp = poll_export(job_id)
+    # The export job is the long pole: start it first and do the Sheets
+    # setup while Intercom prepares the file
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        export_future = executor.submit(run_export_job, start_unix, end_unix, attribute_ids)
+        sheet_future = executor.submit(prepare_rawdata_sheet)
+        job_id, job_resp = export_future.result()
+        grid_rows, existing_ids, next_row = sheet_future.result()
+    svc = get_sheets_service()
 
-    content = download_export(job_resp, job_id)
+    download = download_export(job_resp, job_id)
 
-    rows = parse_export_bytes(content)
-    logger.info("Downloaded %d rows from Intercom export.", len(rows))
+    rows = iter_export_rows(download)
+    # Peek the first row for header auto-detection, then put it back
+    first_row = next(rows, None)
+    if first_row is not None:
+        rows = chain([first_row], rows)
 
     # attr_map - allow auto-detection
     attr_map = {
@@ -495,76 +743,22 @@ def run_window(start_unix: int, end_unix: int):
         "cx_explanation": None
     }
 
-    # Auto-detect CX score & explanation columns (if present)
-    if rows:
-        headers = list(rows[0].keys())
-        # detect score column
-        if attr_map.get("cx_score") is None:
-            for h in headers:
-                hl = h.lower()
-                if any(tok in hl for tok in ("ai_cx", "cx_score", "conversation_cx", "fin_ai", "lastrating", "rating")):
-                    attr_map["cx_score"] = h
-                    logger.info("Auto-detected CX score column: %s", h)
-                    break
-        # detect explanation column
-        if attr_map.get("cx_explanation") is None:
-            for h in headers:
-                hl = h.lower()
-                if any(tok in hl for tok in ("explain", "explanation", "breakdown", "reason", "ai_cx")):
-                    # prefer fields with explanation/breakdown keywords
-                    if "explain" in hl or "breakdown" in hl or "explanation" in hl:
-                        attr_map["cx_explanation"] = h
-                        logger.info("Auto-detected CX explanation column: %s", h)
-                        break
-            # if none matched explicit keywords, pick an ai_cx* field that remains (less likely)
-            if attr_map.get("cx_explanation") is None:
-                for h in headers:
-                    hl = h.lower()
-                    if "ai_cx" in hl and "explain" in hl:
-                        attr_map["cx_explanation"] = h
-                        logger.info("Auto-detected CX explanation column (fallback): %s", h)
-                        break
-
-    # Deduplicate by conversation_id and map rows
-    existing_ids = load_existing_conversation_ids(svc)
-    to_append = []
-    for r in rows:
-        conv_id = r.get("conversation_id") or r.get("id") or r.get(attr_map.get("conversation_id")) or ""
-        if not conv_id:
-            continue
-        if conv_id in existing_ids:
-            continue
-        mapped = map_row_to_canonical(r, attr_map)
-        exported_at = datetime.now(timezone.utc).isoformat()
-        cx_breakdown = ""
-        try:
-            exp_key = attr_map.get("cx_explanation")
-            if exp_key and r.get(exp_key):
-                cx_breakdown = anonymize_text(r.get(exp_key))
-            else:
-                # fallback scan for explanation-like header
-                for k in r.keys():
-                    kl = k.lower()
-                    if any(tok in kl for tok in ("explain", "explanation", "breakdown", "reason")) and r.get(k):
-                        cx_breakdown = anonymize_text(r.get(k))
-                        break
-        except Exception:
-            cx_breakdown = ""
-
-        row_values = [
-            mapped[0] or "",
-            mapped[1] or "",
-            mapped[2] if mapped[2] != "" else "",
-            mapped[3] or "",
-            cx_breakdown,
-            job_id,
-            exported_at,
-            "", "", "", ""
-        ]
-        to_append.append(row_values)
-        existing_ids.add(conv_id)
+    headers = list(first_row.keys()) if first_row is not None else []
+    plan = build_header_plan(headers, attr_map)
 
-    append_rows(svc, to_append)
+    # Deduplicate by conversation_id and map rows, one chunk at a time
+    position = {"next_row": next_row, "grid_rows": grid_rows}
+    # One export, one timestamp for every row it produced
+    exported_at = datetime.now(timezone.utc).isoformat()
+    canonical = iter_canonical_rows(rows, plan, attr_map, existing_ids, job_id, exported_at)
+    appended = 0
+    while True:
+        chunk = list(islice(canonical, APPEND_CHUNK_SIZE))
+        if chunk or not appended:
+            append_rows(svc, chunk, position)
+            appended += len(chunk)
+        if len(chunk) < APPEND_CHUNK_SIZE:
+            break
 
     # Resolve teammate IDs -> names (enrichment)
     try:
@@ -572,7 +766,7 @@ def run_window(start_unix: int, end_unix: int):
     except Exception as e:
         logger.exception("Error during teammate resolution: %s", e)
 
-    logger.info("Run complete. Appended %d new conversations.", len(to_append))
+    logger.info("Run complete. Appended %d new conversations.", appended)
 
 
 # -----------------------------
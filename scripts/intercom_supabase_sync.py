@@ -21,28 +21,60 @@ Usage:
   python intercom_supabase_sync.py              # Default: last 1 day
   python intercom_supabase_sync.py --days 7     # Last 7 days
   python intercom_supabase_sync.py --days 30    # Last 30 days
+  python intercom_supabase_sync.py --days 90 --bulk  # Backfill via Postgres COPY
+  python intercom_supabase_sync.py --days 90 --reuse-stored-tags  # Skip Intercom for enriched rows
 
 Environment Variables Required:
   INTERCOM_TOKEN          - Intercom API token
   SUPABASE_URL            - Supabase project URL (or VITE_SUPABASE_URL)
   SUPABASE_SERVICE_ROLE_KEY - Supabase service role key
   INTERCOM_APP_ID         - Optional, defaults to b37vb7kt
+  SUPABASE_UPSERT_BATCH_SIZE - Optional, rows per upsert request (default 1000)
+  SUPABASE_UPSERT_WORKERS - Optional, concurrent upsert requests (default 8)
+  SUPABASE_DB_URL         - Required only for --bulk (direct Postgres connection)
+  INTERCOM_ADMINS_CACHE   - Optional, admins cache file (default ~/.cache/qa-dashboard/admins.json)
+  INTERCOM_EXPORT_TAGS_ATTRIBUTE - Optional, export attribute holding "|"-separated tag
+                            names; used only if the conversation dataset lists it.
+                            Rows with tags in the CSV skip enrichment
 """
 
 import os
+import sys
 import io
 import csv
 import gzip
 import zipfile
 import json
 import time
+import tempfile
+import random
 import re
 import logging
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, List, Any, Tuple
+
+try:
+    import orjson  # optional: faster JSON encode/decode on the wire path
+except ImportError:
+    orjson = None
+
+try:
+    import psycopg  # optional: --bulk COPY path for large backfills
+    from psycopg.types.json import Jsonb
+except ImportError:
+    psycopg = None
+from datetime import date, datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from functools import lru_cache
+from itertools import chain, islice
+from typing import Optional, Dict, List, Any, Tuple, Iterable, Iterator, BinaryIO
+
+# Helpers shared with the scripts in scripts/intercom/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "intercom"))
+from intercom_common import AdminsCache, RateLimiter
 
 # Load environment variables from .env file
 load_dotenv()
@@ -53,6 +85,11 @@ INTERCOM_TOKEN = os.environ.get("INTERCOM_TOKEN")
 INTERCOM_APP_ID = os.environ.get("INTERCOM_APP_ID", "b37vb7kt")
 SUPABASE_URL = os.environ.get("SUPABASE_URL") or os.environ.get("VITE_SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL")
+# The reporting export has no documented tags attribute; when the workspace's
+# conversation dataset exposes one, name it here to classify tags from the CSV
+# without enrichment. It is checked against get_datasets before each export.
+EXPORT_TAGS_ATTRIBUTE = os.environ.get("INTERCOM_EXPORT_TAGS_ATTRIBUTE")
 
 # Validate required environment variables
 missing_vars = []
@@ -68,6 +105,20 @@ if missing_vars:
 
 INTERCOM_BASE = "https://api.intercom.io"
 INTERCOM_API_VERSION = "2.14"
+ADMIN_PAGE_WORKERS = 8
+ADMINS_PER_PAGE = 150  # Intercom's maximum page size
+SEARCH_PAGE_SIZE = 150  # Intercom's maximum per_page for /conversations/search
+ENRICH_WORKERS = 16  # also the Intercom session's connection pool size
+# IDs per in.(...) filter when looking up already-enriched rows; keeps the URL short
+STORED_LOOKUP_CHUNK = 200
+ENRICHMENT_COLUMNS = ("conversation_tags", "workspace", "is_360_queue", "queue_type_360")
+DOWNLOAD_CHUNK_BYTES = 1 << 20  # exports are spooled to disk 1 MiB at a time
+
+# Rows per PostgREST upsert request; lower it if large backfills hit request-size limits
+UPSERT_BATCH_SIZE = int(os.environ.get("SUPABASE_UPSERT_BATCH_SIZE", "1000"))
+UPSERT_MAX_RETRIES = 4
+UPSERT_WORKERS = int(os.environ.get("SUPABASE_UPSERT_WORKERS", "8"))
+UPSERT_MAX_IN_FLIGHT = UPSERT_WORKERS * 2
 
 # Logging
 logging.basicConfig(
@@ -76,6 +127,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def json_loads(content: bytes) -> Any:
+    """Decode a JSON response body with orjson when installed, else the stdlib"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def json_dumps(data: Any) -> bytes:
+    """Encode a JSON request body with orjson when installed, else the stdlib"""
+    return orjson.dumps(data) if orjson else json.dumps(data).encode("utf-8")
+
 # -----------------------------
 # Supabase Client (using requests, no SDK dependency)
 # -----------------------------
@@ -90,6 +149,9 @@ class SupabaseClient:
             "Content-Type": "application/json",
             "Prefer": "return=minimal"
         }
+        # Keep-alive pool sized for concurrent upserts; retries are handled in upsert()
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=UPSERT_WORKERS, pool_maxsize=UPSERT_WORKERS))
     
     def upsert(self, table: str, data: List[Dict], on_conflict: str = "conversation_id") -> bool:
         """Upsert data to a table"""
@@ -102,13 +164,31 @@ class SupabaseClient:
         # Supabase expects on_conflict as a query parameter
         params = {"on_conflict": on_conflict}
         
-        response = requests.post(
-            endpoint,
-            headers=headers,
-            params=params,
-            json=data,
-            timeout=120
-        )
+        # Serialize once up front (orjson when installed) so retries reuse the body
+        body = json_dumps(data)
+        
+        # Retry 5xx responses with exponential backoff; 4xx means a bad payload
+        for attempt in range(UPSERT_MAX_RETRIES + 1):
+            response = self.session.post(
+                endpoint,
+                headers=headers,
+                params=params,
+                data=body,
+                timeout=120
+            )
+            timed_out = response.status_code >= 500 and b"57014" in response.content
+            if response.status_code < 500 or timed_out or attempt == UPSERT_MAX_RETRIES:
+                break
+            delay = 2 ** attempt
+            logger.warning(f"Upsert got {response.status_code}, retrying in {delay}s...")
+            time.sleep(delay)
+        
+        # A statement timeout (Postgres 57014) means the batch is too heavy for
+        # PostgREST's statement_timeout; resending it won't help, so halve it
+        if timed_out and len(data) > 1:
+            half = len(data) // 2
+            logger.warning(f"Upsert of {len(data)} rows hit statement timeout, splitting into {half} + {len(data) - half}")
+            return self.upsert(table, data[:half], on_conflict) and self.upsert(table, data[half:], on_conflict)
         
         if response.status_code not in (200, 201, 204):
             logger.error(f"Upsert failed: {response.status_code} - {response.text}")
@@ -116,12 +196,11 @@ class SupabaseClient:
         
         return True
     
-    def select(self, table: str, columns: str = "*") -> List[Dict]:
-        """Select data from a table"""
+    def select(self, table: str, params: Dict[str, str]) -> List[Dict]:
+        """Select rows matching PostgREST filter params (e.g. {"id": "in.(1,2)"})"""
         endpoint = f"{self.url}/rest/v1/{table}"
-        params = {"select": columns}
         
-        response = requests.get(
+        response = self.session.get(
             endpoint,
             headers=self.headers,
             params=params,
@@ -130,13 +209,19 @@ class SupabaseClient:
         
         if response.status_code != 200:
             logger.error(f"Select failed: {response.status_code} - {response.text}")
-            return []
+            raise RuntimeError(f"Supabase select failed: {response.status_code}")
         
-        return response.json()
+        return json_loads(response.content)
 
 # Initialize Supabase client
 supabase = SupabaseClient(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
+# -----------------------------
+# Rate Limiting
+# -----------------------------
+# Shared by all enrichment threads; also retries 429s (see intercom_common)
+rate_limiter = RateLimiter()
+
 # -----------------------------
 # Workspace & 360 Queue Detection
 # UPDATED: Using exact tag patterns from production
@@ -171,6 +256,31 @@ CEQ_360_PATTERNS = [
     '3 - scammers',
 ]
 
+def _build_tag_keyword_re() -> Tuple[re.Pattern, Dict[str, str]]:
+    """
+    Compile every workspace keyword and 360 pattern into one alternation with
+    a named group per category ('billing', 'ceq' or a workspace name). The
+    alternation sits inside a lookahead so matches may overlap, like the
+    independent substring checks this replaces.
+    """
+    categories = list(WORKSPACE_KEYWORDS.items())
+    categories += [('billing', BILLING_360_PATTERNS), ('ceq', CEQ_360_PATTERNS)]
+    groups = {}
+    alternatives = []
+    for i, (category, keywords) in enumerate(categories):
+        groups[f'g{i}'] = category
+        alternatives.append(f"(?P<g{i}>{'|'.join(re.escape(k.lower()) for k in keywords)})")
+    return re.compile(f"(?=(?:{'|'.join(alternatives)}))"), groups
+
+_TAG_KEYWORD_RE, _TAG_KEYWORD_GROUPS = _build_tag_keyword_re()
+
+
+@lru_cache(maxsize=4096)
+def _tag_categories(all_tags_lower: str) -> frozenset:
+    """Categories whose keywords occur in the joined lowercase tags (one scan)"""
+    # The tag vocabulary is small, so the same tag combinations recur constantly
+    return frozenset(_TAG_KEYWORD_GROUPS[m.lastgroup] for m in _TAG_KEYWORD_RE.finditer(all_tags_lower))
+
 
 def determine_workspace(tags: List[str], is_360_queue: bool = False) -> str:
     """
@@ -186,16 +296,9 @@ def determine_workspace(tags: List[str], is_360_queue: bool = False) -> str:
     if not tags:
         base_workspace = 'Unknown'
     else:
-        all_tags_lower = ' '.join(t.lower() for t in tags)
-
-        base_workspace = 'Unknown'
-        for workspace, keywords in WORKSPACE_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword.lower() in all_tags_lower:
-                    base_workspace = workspace
-                    break
-            if base_workspace != 'Unknown':
-                break
+        found = _tag_categories(' '.join(t.lower() for t in tags))
+        # First workspace in WORKSPACE_KEYWORDS order wins when several match
+        base_workspace = next((ws for ws in WORKSPACE_KEYWORDS if ws in found), 'Unknown')
 
     # Add 360 prefix if applicable
     if is_360_queue and base_workspace != 'Unknown':
@@ -224,22 +327,10 @@ def determine_360_queue(tags: List[str]) -> Tuple[bool, Optional[str]]:
         return False, None
     
     # Join all tags into a single lowercase string for pattern matching
-    all_tags_lower = ' '.join(t.lower() for t in tags)
+    found = _tag_categories(' '.join(t.lower() for t in tags))
     
-    is_billing = False
-    is_ceq = False
-    
-    # Check for billing 360 tags
-    for pattern in BILLING_360_PATTERNS:
-        if pattern.lower() in all_tags_lower:
-            is_billing = True
-            break
-    
-    # Check for CEQ 360 tags
-    for pattern in CEQ_360_PATTERNS:
-        if pattern.lower() in all_tags_lower:
-            is_ceq = True
-            break
+    is_billing = 'billing' in found
+    is_ceq = 'ceq' in found
     
     # Determine queue type
     if is_billing and is_ceq:
@@ -255,17 +346,35 @@ def determine_360_queue(tags: List[str]) -> Tuple[bool, Optional[str]]:
 # -----------------------------
 # PII Redaction
 # -----------------------------
+# All PII patterns fused into one alternation so each string is scanned once.
+# Alternatives are tried in order at each position: email, then number, then phone.
+# \b\d{6,}\b also covers 13-19 digit card numbers, so one group redacts both
+_PII_RE = re.compile(
+    r'(?P<email>[\w\.-]+@[\w\.-]+\.\w+)'
+    r'|(?P<number>\b\d{6,}\b)'
+    r'|(?P<phone>\+?\d[\d\-\s\(\)]{6,}\d)'
+)
+_PII_LABELS = {
+    'email': '[REDACTED_EMAIL]',
+    'number': '[REDACTED_NUMBER]',
+    'phone': '[REDACTED_PHONE]',
+}
+# Every PII pattern needs an '@' or a digit
+_PII_TRIGGER_RE = re.compile(r'[@\d]')
+
+def _pii_repl(match: re.Match) -> str:
+    return _PII_LABELS[match.lastgroup]
+
 def anonymize_text(text: str) -> str:
     """Redact PII from text"""
     if not text:
         return text
     s = str(text)
-    s = re.sub(r'[\w\.-]+@[\w\.-]+\.\w+', '[REDACTED_EMAIL]', s)
-    s = re.sub(r'\b\d{13,19}\b', '[REDACTED_NUMBER]', s)
-    s = re.sub(r'\b\d{6,}\b', '[REDACTED_NUMBER]', s)
-    s = re.sub(r'(\+?\d[\d\-\s\(\)]{6,}\d)', '[REDACTED_PHONE]', s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
+    # Most explanations have neither, so one character-class scan skips the PII pass
+    if _PII_TRIGGER_RE.search(s):
+        s = _PII_RE.sub(_pii_repl, s)
+    # split() with no argument already splits on whitespace runs and drops the ends
+    return " ".join(s.split())
 
 # -----------------------------
 # Timestamp Parsing (CRITICAL - Replicated from working script)
@@ -289,9 +398,24 @@ def parse_timestamp_to_date(ts: Any) -> Optional[str]:
     if not ts_str or ts_str == "" or ts_str == "0":
         return None
     
+    return _parse_ts_cached(ts_str)
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+
+@lru_cache(maxsize=8192)
+def _parse_ts_cached(ts_str: str) -> Optional[str]:
+    """
+    Parse one trimmed, non-empty timestamp string. Cached because exports
+    repeat timestamps (bulk-closed conversations share the same second).
+    """
+    # Fast path: Intercom exports are almost always 10-digit Unix seconds
+    if len(ts_str) == 10 and ts_str.isascii() and ts_str.isdigit() and ts_str > "1000000000":
+        return date.fromordinal(_EPOCH_ORDINAL + int(ts_str) // 86400).isoformat()
+    
     # Check for ISO date string first (contains '-' and is long enough)
     if '-' in ts_str and len(ts_str) >= 10:
-        date_match = re.match(r'^(\d{4})-(\d{2})-(\d{2})', ts_str)
+        date_match = _ISO_DATE_RE.match(ts_str)
         if date_match:
             year, month, day = date_match.groups()
             result = f"{year}-{month}-{day}"
@@ -310,20 +434,21 @@ def parse_timestamp_to_date(ts: Any) -> Optional[str]:
         
         if ts_num > SECONDS_THRESHOLD:
             # Milliseconds
-            date_obj = datetime.fromtimestamp(ts_num / 1000, tz=timezone.utc)
-            logger.debug(f"Timestamp {ts} (milliseconds) -> {date_obj.date().isoformat()}")
+            seconds = ts_num / 1000
         elif ts_num > 1_000_000_000:
             # Seconds
-            date_obj = datetime.fromtimestamp(ts_num, tz=timezone.utc)
-            logger.debug(f"Timestamp {ts} (seconds) -> {date_obj.date().isoformat()}")
+            seconds = ts_num
         else:
-            logger.warning(f"Timestamp {ts} too small to be valid")
+            logger.warning(f"Timestamp {ts_str} too small to be valid")
             return None
         
-        return date_obj.date().isoformat()
+        # The UTC date is whole days since the epoch; no datetime/tzinfo needed
+        result = date.fromordinal(_EPOCH_ORDINAL + int(seconds // 86400)).isoformat()
+        logger.debug(f"Timestamp {ts_str} -> {result}")
+        return result
         
-    except (ValueError, TypeError, OSError) as e:
-        logger.debug(f"Failed to parse timestamp {ts}: {e}")
+    except (ValueError, TypeError, OSError, OverflowError) as e:
+        logger.debug(f"Failed to parse timestamp {ts_str}: {e}")
     
     # Try ISO format parsing
     try:
@@ -332,12 +457,44 @@ def parse_timestamp_to_date(ts: Any) -> Optional[str]:
     except (ValueError, TypeError):
         pass
     
-    logger.warning(f"Could not parse timestamp: {ts}")
+    logger.warning(f"Could not parse timestamp: {ts_str}")
     return None
 
 # -----------------------------
 # Intercom Export API Helpers
 # -----------------------------
+# One keep-alive session for every Intercom call; GETs retry 5xx with backoff.
+# 429s are left to rate_limiter.send so retried requests count against the window
+_session = requests.Session()
+_session.headers.update({
+    "Authorization": f"Bearer {INTERCOM_TOKEN}",
+    "Intercom-Version": INTERCOM_API_VERSION,
+    "Accept": "application/json"
+})
+_session.mount("https://", HTTPAdapter(pool_connections=ENRICH_WORKERS, pool_maxsize=ENRICH_WORKERS, max_retries=Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=[500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False
+)))
+
+def verify_export_attribute(attribute_id: str, dataset_id: str = "conversation") -> bool:
+    """True if Intercom lists attribute_id in the reporting dataset"""
+    url = f"{INTERCOM_BASE}/export/reporting_data/get_datasets"
+    try:
+        r = rate_limiter.send(lambda: _session.get(url, timeout=30))
+        r.raise_for_status()
+        datasets = json_loads(r.content).get("data") or []
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Could not list export datasets: {e}")
+        return False
+    for dataset in datasets:
+        if dataset.get("id") == dataset_id:
+            return any(a.get("id") == attribute_id for a in dataset.get("attributes") or [])
+    return False
+
 def enqueue_export(start_time_unix: int, end_time_unix: int, attribute_ids: List[str]) -> Tuple[str, Dict]:
     """Enqueue an export job with Intercom"""
     url = f"{INTERCOM_BASE}/export/reporting_data/enqueue"
@@ -347,19 +504,12 @@ def enqueue_export(start_time_unix: int, end_time_unix: int, attribute_ids: List
         "start_time": int(start_time_unix),
         "end_time": int(end_time_unix)
     }
-    headers = {
-        "Authorization": f"Bearer {INTERCOM_TOKEN}",
-        "Content-Type": "application/json",
-        "Intercom-Version": INTERCOM_API_VERSION,
-        "Accept": "application/json"
-    }
-    
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
+    r = _session.post(url, data=json_dumps(payload), headers={"Content-Type": "application/json"}, timeout=60)
     if r.status_code != 200:
         logger.error(f"Enqueue failed: {r.status_code} {r.text}")
         r.raise_for_status()
     
-    resp = r.json()
+    resp = json_loads(r.content)
     job_id = resp.get("job_identifier") or resp.get("id") or resp.get("jobId")
     if not job_id:
         raise RuntimeError("No job_identifier in enqueue response")
@@ -370,24 +520,31 @@ def enqueue_export(start_time_unix: int, end_time_unix: int, attribute_ids: List
 def poll_export(job_identifier: str, max_wait_seconds: int = 600) -> Dict:
     """Poll export job until complete"""
     url = f"{INTERCOM_BASE}/export/reporting_data/{job_identifier}"
-    headers = {
-        "Authorization": f"Bearer {INTERCOM_TOKEN}",
-        "Intercom-Version": INTERCOM_API_VERSION,
-        "Accept": "application/json"
-    }
-    
-    start = time.time()
-    delay = 5
+    start = time.monotonic()
+    delay = 1.0
     
     while True:
         params = {"app_id": INTERCOM_APP_ID} if INTERCOM_APP_ID else None
-        r = requests.get(url, headers=headers, params=params, timeout=30)
+        r = _session.get(url, params=params, timeout=30)
+        
+        # Throttled: wait as long as the server asks, then poll again. The
+        # session's adapter only retries 5xx, so this is the one 429 policy
+        if r.status_code == 429:
+            if time.monotonic() - start > max_wait_seconds:
+                raise TimeoutError("Export job timeout")
+            try:
+                retry_after = float(r.headers.get("Retry-After", delay))
+            except ValueError:
+                retry_after = delay
+            logger.warning(f"Poll throttled ({r.status_code}), retrying in {retry_after:.1f}s")
+            time.sleep(retry_after)
+            continue
         
         if r.status_code != 200:
             logger.error(f"Poll failed: {r.status_code} {r.text}")
             r.raise_for_status()
         
-        data = r.json()
+        data = json_loads(r.content)
         status = data.get("status") or data.get("state") or ""
         logger.info(f"Job {job_identifier} status={status}")
         
@@ -400,18 +557,34 @@ def poll_export(job_identifier: str, max_wait_seconds: int = 600) -> Dict:
         if status and status.lower() in ("failed", "error"):
             raise RuntimeError(f"Export job failed: {data}")
         
-        if time.time() - start > max_wait_seconds:
+        if time.monotonic() - start > max_wait_seconds:
             raise TimeoutError("Export job timeout")
         
-        time.sleep(delay)
-        delay = min(60, delay * 2)
+        # Jitter so concurrent runs do not poll in lockstep
+        time.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(30, delay * 1.5)
 
-def download_export(job_response: Dict, job_identifier: str) -> bytes:
-    """Download export data with multiple fallback methods"""
+def spool_response(resp: requests.Response) -> BinaryIO:
+    """
+    Stream a response body into an anonymous temp file and return it rewound,
+    so memory stays at one chunk however large the export is (zip exports
+    need a seekable file, so the socket can't be parsed directly).
+    """
+    export_file = tempfile.TemporaryFile()
+    with resp:
+        for chunk in resp.iter_content(DOWNLOAD_CHUNK_BYTES):
+            export_file.write(chunk)
+    export_file.seek(0)
+    return export_file
+
+def download_export(job_response: Dict, job_identifier: str) -> BinaryIO:
+    """Download export data with multiple fallback methods; returns a binary file"""
     
     def try_get(url: str, headers: Dict = None, params: Dict = None) -> Tuple[Optional[int], Any]:
         try:
-            r = requests.get(url, headers=headers or {}, params=params, timeout=120)
+            r = _session.get(url, headers=headers or {}, params=params, timeout=120, stream=True)
+            if r.status_code != 200:
+                r.close()  # release the pooled connection without reading the body
             return r.status_code, r
         except Exception as e:
             return None, e
@@ -420,117 +593,190 @@ def download_export(job_response: Dict, job_identifier: str) -> bytes:
     download_url = job_response.get("download_url")
     if download_url:
         logger.info("Attempting download_url with Authorization...")
-        headers = {"Authorization": f"Bearer {INTERCOM_TOKEN}", "Accept": "application/octet-stream"}
+        # A None value drops the session default for this request
+        headers = {"Accept": "application/octet-stream", "Intercom-Version": None}
         status, resp = try_get(download_url, headers=headers)
         if isinstance(resp, requests.Response) and resp.status_code == 200:
-            logger.info("Downloaded from download_url")
-            return resp.content
+            logger.info("Downloading from download_url")
+            return spool_response(resp)
         logger.warning(f"download_url failed: {status}")
         
         # Method 2: Try without authorization (presigned URL)
         logger.info("Retrying download_url without Authorization...")
-        headers2 = {"Accept": "*/*"}
+        headers2 = {"Accept": "*/*", "Authorization": None, "Intercom-Version": None}
         status2, resp2 = try_get(download_url, headers=headers2)
         if isinstance(resp2, requests.Response) and resp2.status_code == 200:
-            logger.info("Downloaded from download_url (no auth)")
-            return resp2.content
+            logger.info("Downloading from download_url (no auth)")
+            return spool_response(resp2)
     
     # Method 3: Fallback endpoint
     logger.info("Trying fallback endpoint...")
     fallback_url = f"{INTERCOM_BASE}/download/reporting_data/{job_identifier}"
-    headers3 = {
-        "Authorization": f"Bearer {INTERCOM_TOKEN}",
-        "Accept": "application/octet-stream",
-        "Intercom-Version": INTERCOM_API_VERSION
-    }
+    headers3 = {"Accept": "application/octet-stream"}
     params = {"app_id": INTERCOM_APP_ID, "job_identifier": job_identifier}
     status3, resp3 = try_get(fallback_url, headers=headers3, params=params)
     
     if isinstance(resp3, requests.Response) and resp3.status_code == 200:
-        logger.info("Downloaded from fallback endpoint")
-        return resp3.content
+        logger.info("Downloading from fallback endpoint")
+        return spool_response(resp3)
     
     raise RuntimeError("All download attempts failed")
 
-def parse_export_bytes(content_bytes: bytes) -> List[Dict]:
-    """Parse export content (gzip, zip, or plain CSV)"""
-    
-    # Try gzip
-    try:
-        if content_bytes[:2] == b'\x1f\x8b':
-            with gzip.GzipFile(fileobj=io.BytesIO(content_bytes)) as gz:
-                text = gz.read().decode("utf-8")
-                return list(csv.DictReader(io.StringIO(text)))
-    except Exception:
-        pass
-    
-    # Try zip
-    try:
-        if content_bytes[:4] == b'PK\x03\x04':
-            z = zipfile.ZipFile(io.BytesIO(content_bytes))
-            name = z.namelist()[0]
-            with z.open(name) as f:
-                text = f.read().decode("utf-8")
-                return list(csv.DictReader(io.StringIO(text)))
-    except Exception:
-        pass
-    
-    # Plain CSV fallback
-    text = content_bytes.decode("utf-8")
-    return list(csv.DictReader(io.StringIO(text)))
+def iter_export_rows(export_file: BinaryIO) -> Iterator[List[str]]:
+    """
+    Yield rows from an export file (gzip, zip, or plain CSV) as they are
+    decoded, as plain lists: the first row yielded is the header. The file is
+    closed once the rows are exhausted.
+    """
+    magic = export_file.read(4)
+    export_file.seek(0)
+    if magic == b'PK\x03\x04':
+        # Close the archive too, not just the member stream
+        with export_file, zipfile.ZipFile(export_file) as z, z.open(z.namelist()[0]) as member:
+            with io.TextIOWrapper(member, encoding="utf-8", newline="") as text_stream:
+                yield from csv.reader(text_stream)
+        return
+
+    raw = gzip.GzipFile(fileobj=export_file) if magic[:2] == b'\x1f\x8b' else export_file
+    with export_file, io.TextIOWrapper(raw, encoding="utf-8", newline="") as text_stream:
+        yield from csv.reader(text_stream)
 
 # -----------------------------
 # Admin/Teammate Resolution
 # -----------------------------
-def fetch_all_admins_map() -> Dict[str, str]:
-    """Fetch all admin/teammate names from Intercom"""
+def add_admins(admins_map: Dict[str, str], data: Dict) -> None:
+    """Merge one /admins response page into admins_map"""
+    admin_list = data.get("admins") or data.get("data") or []
+    for a in admin_list:
+        aid = a.get("id") or a.get("admin_id")
+        name = a.get("name") or a.get("email") or str(aid)
+        if aid:
+            admins_map[str(aid)] = name
+
+def fetch_admins_page(url: str, params: Optional[Dict] = None) -> Optional[Dict]:
+    """GET one page of /admins; returns the decoded body or None on failure"""
+    r = rate_limiter.send(lambda: _session.get(url, params=params, timeout=30))
+    if r.status_code != 200:
+        logger.warning(f"Failed to fetch admins: {r.status_code}")
+        return None
+    return json_loads(r.content)
+
+# Admin roster changes on the order of days; reuse it across frequent cron runs
+admins_cache = AdminsCache()
+_admins_refreshed = False  # at most one /admins re-fetch per run
+
+def fetch_all_admins_map(refresh: bool = False) -> Dict[str, str]:
+    """Fetch all admin/teammate names from Intercom (cached on disk, see intercom_common)"""
+    global _admins_refreshed
+    admins_cache.load()
+    if not refresh and admins_cache.fresh:
+        logger.info(f"Loaded {len(admins_cache.admins)} admin/teammate records from cache")
+        return dict(admins_cache.admins)
+    
+    _admins_refreshed = True
     admins_map = {}
     url = f"{INTERCOM_BASE}/admins"
-    headers = {"Authorization": f"Bearer {INTERCOM_TOKEN}", "Accept": "application/json"}
-    params = {"per_page": 50}
+    data = fetch_admins_page(url, {"per_page": ADMINS_PER_PAGE})
     
-    while True:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
-        if r.status_code != 200:
-            logger.warning(f"Failed to fetch admins: {r.status_code}")
-            break
-        
-        data = r.json()
-        admin_list = data.get("admins") or data.get("data") or []
-        
-        for a in admin_list:
-            aid = a.get("id") or a.get("admin_id")
-            name = a.get("name") or a.get("email") or str(aid)
-            if aid:
-                admins_map[str(aid)] = name
-        
+    if data is not None:
+        add_admins(admins_map, data)
         pages = data.get("pages") or {}
-        next_url = pages.get("next")
-        if next_url:
-            url = next_url
-            params = None
-            continue
-        break
+        
+        # Page 1 tells us how many pages exist: fetch the rest concurrently
+        total_pages = pages.get("total_pages")
+        if isinstance(total_pages, int) and total_pages > 1:
+            page_params = [{"per_page": ADMINS_PER_PAGE, "page": p} for p in range(2, total_pages + 1)]
+            with ThreadPoolExecutor(max_workers=ADMIN_PAGE_WORKERS) as executor:
+                for page in executor.map(lambda params: fetch_admins_page(url, params), page_params):
+                    if page is not None:
+                        add_admins(admins_map, page)
+        else:
+            # Otherwise follow next links one page at a time
+            next_url = pages.get("next")
+            while next_url:
+                data = fetch_admins_page(next_url)
+                if data is None:
+                    break
+                add_admins(admins_map, data)
+                next_url = (data.get("pages") or {}).get("next")
     
     logger.info(f"Fetched {len(admins_map)} admin/teammate records")
+    if admins_map:
+        admins_cache.set_admins(admins_map)
+        admins_cache.save()
     return admins_map
 
+def lookup_missing_admin(agent_id: str, admins_map: Dict[str, str]) -> Optional[str]:
+    """
+    Resolve an ID missing from admins_map: re-fetch /admins once per run
+    (a cached map misses teammates added since it was fetched), and record
+    IDs still unknown afterwards so later runs don't re-fetch for them.
+    """
+    if admins_cache.is_known_miss(agent_id):
+        return None
+    if not _admins_refreshed:
+        logger.info(f"Agent ID {agent_id} not in cached admins, re-fetching /admins")
+        admins_map.update(fetch_all_admins_map(refresh=True))
+        name = admins_map.get(agent_id)
+        if name:
+            return name
+    # Only trust a miss against a listing that actually succeeded
+    if admins_cache.fresh:
+        admins_cache.add_misses([agent_id])
+        admins_cache.save()
+    return None
+
+_HEXSET = frozenset("0123456789abcdefABCDEF-")
+
+def _looks_like_id(value: str) -> bool:
+    """True for numeric or UUID-like values (as opposed to a teammate name)"""
+    return value.isdigit() or (len(value) >= 8 and all(c in _HEXSET for c in value))
+
 def resolve_agent_name(agent_id: str, admins_map: Dict[str, str]) -> str:
-    """Resolve agent ID to friendly name"""
+    """
+    Resolve agent ID to friendly name.
+
+    Misses are written back into admins_map (a per-run negative cache), so
+    each distinct unknown value is classified once rather than once per row.
+    """
     if not agent_id or agent_id == "Unknown":
         return "Unassigned"
     
-    agent_str = str(agent_id).strip()
+    # Export values are already strings: try them as-is before normalizing
+    name = admins_map.get(agent_id)
+    if name:
+        return name
     
-    # Check if already a name (not numeric or UUID-like)
-    if not re.fullmatch(r"\d+", agent_str) and not re.fullmatch(r"[0-9a-fA-F\-]{8,}", agent_str):
-        return agent_id
-    
-    return admins_map.get(agent_str, "Unassigned")
+    agent_str = str(agent_id).strip()
+    name = admins_map.get(agent_str)
+    if not name:
+        # Not in the map: keep values that are already a name, otherwise
+        # try one /admins refresh before leaving the ID unresolved
+        if _looks_like_id(agent_str):
+            name = lookup_missing_admin(agent_str, admins_map) or "Unassigned"
+        else:
+            name = agent_id
+    admins_map[agent_id] = name
+    return name
 
 # -----------------------------
 # Conversation Enrichment (Tags from Individual API)
 # -----------------------------
+def extract_tags(conversation: Dict) -> List[str]:
+    """Tag names from an Intercom conversation object"""
+    tags_obj = conversation.get("tags") or {}
+    return [t.get("name", "") for t in tags_obj.get("tags") or [] if t.get("name")]
+
+def classify_tags(tags: List[str]) -> Tuple[List[str], str, bool, Optional[str]]:
+    """Returns: (tags, workspace, is_360_queue, queue_type_360)"""
+    # Determine 360 queue first
+    is_360, queue_type = determine_360_queue(tags)
+    
+    # Then determine workspace (with 360 prefix if applicable)
+    workspace = determine_workspace(tags, is_360_queue=is_360)
+    
+    return tags, workspace, is_360, queue_type
+
 def enrich_conversation_with_tags(conversation_id: str) -> Tuple[List[str], str, bool, Optional[str]]:
     """
     Fetch individual conversation to get tags.
@@ -538,102 +784,173 @@ def enrich_conversation_with_tags(conversation_id: str) -> Tuple[List[str], str,
     """
     try:
         url = f"{INTERCOM_BASE}/conversations/{conversation_id}"
-        headers = {
-            "Authorization": f"Bearer {INTERCOM_TOKEN}",
-            "Accept": "application/json",
-            "Intercom-Version": INTERCOM_API_VERSION
-        }
-        
-        r = requests.get(url, headers=headers, timeout=30)
+        r = rate_limiter.send(lambda: _session.get(url, timeout=30))
         
         if r.status_code != 200:
             logger.debug(f"Failed to fetch conversation {conversation_id}: {r.status_code}")
             return [], 'Unknown', False, None
         
-        data = r.json()
-        
-        # Extract tags
-        tags = []
-        if data.get("tags") and data["tags"].get("tags"):
-            tags = [t.get("name", "") for t in data["tags"]["tags"] if t.get("name")]
-        
-        # Determine 360 queue first
-        is_360, queue_type = determine_360_queue(tags)
-        
-        # Then determine workspace (with 360 prefix if applicable)
-        workspace = determine_workspace(tags, is_360_queue=is_360)
-        
-        return tags, workspace, is_360, queue_type
+        return classify_tags(extract_tags(json_loads(r.content)))
         
     except Exception as e:
         logger.debug(f"Error enriching conversation {conversation_id}: {e}")
         return [], 'Unknown', False, None
 
+def search_conversation_tags(conversation_ids: List[str]) -> Optional[Dict[str, List[str]]]:
+    """
+    Tags for up to SEARCH_PAGE_SIZE conversations from POST /conversations/search
+    (id IN [...]), keyed by conversation ID. Returns None if the search fails.
+    """
+    query = {"field": "id", "operator": "IN", "value": conversation_ids}
+    pagination = {"per_page": SEARCH_PAGE_SIZE}
+    tags_by_id = {}
+    try:
+        while True:
+            body = json_dumps({"query": query, "pagination": pagination})
+            r = rate_limiter.send(lambda: _session.post(
+                f"{INTERCOM_BASE}/conversations/search",
+                data=body,
+                headers={"Content-Type": "application/json"},
+                timeout=60
+            ))
+            if r.status_code != 200:
+                logger.warning(f"Conversation search failed: {r.status_code}, falling back to per-conversation fetches")
+                return None
+            
+            data = json_loads(r.content)
+            for conversation in data.get("conversations") or []:
+                tags_by_id[str(conversation.get("id"))] = extract_tags(conversation)
+            
+            starting_after = ((data.get("pages") or {}).get("next") or {}).get("starting_after")
+            if not starting_after:
+                return tags_by_id
+            pagination = {"per_page": SEARCH_PAGE_SIZE, "starting_after": starting_after}
+    except Exception as e:
+        logger.warning(f"Conversation search error: {e}, falling back to per-conversation fetches")
+        return None
+
+def enrich_conversations_chunk(conversation_ids: List[str]) -> List[Tuple[List[str], str, bool, Optional[str]]]:
+    """
+    Enrichment results for one search-sized chunk, in input order. IDs the
+    search did not return (or every ID, if it failed) are fetched one by one.
+    """
+    tags_by_id = search_conversation_tags(conversation_ids) or {}
+    results = []
+    for conversation_id in conversation_ids:
+        tags = tags_by_id.get(conversation_id)
+        if tags is not None:
+            results.append(classify_tags(tags))
+        else:
+            results.append(enrich_conversation_with_tags(conversation_id))
+    return results
+
 # -----------------------------
 # Parse Conversation Row
 # -----------------------------
-def parse_conversation_row(row: Dict, admins_map: Dict[str, str]) -> Dict:
+# Export columns read per row, in priority order
+_TS_FIELDS = ("conversation_started_at", "conversation_last_closed_at")
+_AGENT_FIELDS = ("currently_assigned_teammate_id", "currently_assigned_teammate_raw_id", "assignee_id")
+_SCORE_FIELDS = ("ai_cx_score_rating", "conversation_rating", "fin_ai_agent_rating")
+# Tag names may contain commas, so only "|" separates them
+_TAG_SPLIT_RE = re.compile(r'\s*\|\s*')
+
+def build_column_plan(header: List[str], tags_attribute: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Resolve the export columns to list positions once per export, so each
+    row is read by index instead of through a per-row dict.
+    """
+    idx = {name: i for i, name in enumerate(header)}
+    
+    def positions(fields: Tuple[str, ...]) -> Tuple[int, ...]:
+        return tuple(idx[f] for f in fields if f in idx)
+    
+    return {
+        "width": len(header),
+        "conversation_id": idx.get("conversation_id"),
+        "ts": positions(_TS_FIELDS),
+        "agent": positions(_AGENT_FIELDS),
+        "score": positions(_SCORE_FIELDS),
+        "explanation": idx.get("ai_cx_score_explanation"),
+        "state": idx.get("conversation_state"),
+        "tags": idx.get(tags_attribute) if tags_attribute else None,
+    }
+
+def first_field(row: List[str], positions: Tuple[int, ...]) -> Optional[str]:
+    """Return the first non-empty value among positions, or None"""
+    for i in positions:
+        value = row[i]
+        if value:
+            return value
+    return None
+
+@lru_cache(maxsize=4096)
+def normalize_ai_score(ai_score_raw: str) -> Optional[float]:
+    """
+    Map a raw rating cell (a csv string) to the 1-5 scale (None if unusable).
+
+    Score columns hold a handful of distinct values across the whole export,
+    so caching per value parses each one once instead of once per row.
+    """
+    # Only attempt float() on values that can start a number, so the common
+    # empty / text cells never raise and catch a ValueError
+    if not ai_score_raw or not (ai_score_raw[0].isdigit() or ai_score_raw[0] in "-."):
+        return None
+    try:
+        score_float = float(ai_score_raw)
+    except ValueError:
+        return None
+    if 1 <= score_float <= 5:
+        return round(score_float, 2)
+    if 0 <= score_float <= 100:
+        # Convert percentage to 1-5 scale
+        return round(1 + 4 * (score_float / 100.0), 2)
+    return None
+
+def parse_conversation_row(row: List[str], plan: Dict[str, Any], admins_map: Dict[str, str]) -> Dict:
     """
     Parse Intercom export row into qa_metrics format.
     
     CRITICAL: Uses conversation_started_at for the date (not closed_at).
     This matches the working Google Sheets script behavior.
-    """
     
-    # Get timestamps - prioritize started_at
-    started_at = row.get("conversation_started_at") or ""
-    closed_at = row.get("conversation_last_closed_at") or ""
-    
-    # CRITICAL: Use started_at first (when conversation actually began)
-    metric_date = parse_timestamp_to_date(started_at)
+    row is a csv.reader list at least plan["width"] long; columns are read
+    by the positions in plan (see build_column_plan).
+    """
     
-    if not metric_date:
-        metric_date = parse_timestamp_to_date(closed_at)
+    # Conversation ID
+    conv_id = row[plan["conversation_id"]] or ""
+    
+    # CRITICAL: Use started_at first (when conversation actually began),
+    # then closed_at - _TS_FIELDS is in that order
+    metric_date = None
+    for i in plan["ts"]:
+        metric_date = parse_timestamp_to_date(row[i])
+        if metric_date:
+            break
     
     if not metric_date:
-        logger.warning(f"No valid timestamp for {row.get('conversation_id')}, using today")
+        logger.warning(f"No valid timestamp for {conv_id}, using today")
         metric_date = datetime.now(timezone.utc).date().isoformat()
     
-    # Conversation ID
-    conv_id = row.get("conversation_id") or ""
-    
     # Agent
-    agent_raw = (
-        row.get("currently_assigned_teammate_id") or
-        row.get("currently_assigned_teammate_raw_id") or
-        row.get("assignee_id") or
-        "Unknown"
-    )
+    agent_raw = first_field(row, plan["agent"]) or "Unknown"
     agent_name = resolve_agent_name(agent_raw, admins_map)
     
     # AI Score
-    ai_score_raw = (
-        row.get("ai_cx_score_rating") or
-        row.get("conversation_rating") or
-        row.get("fin_ai_agent_rating") or
-        ""
-    )
+    ai_score_raw = first_field(row, plan["score"]) or ""
     
-    ai_score = None
-    if ai_score_raw:
-        try:
-            score_float = float(ai_score_raw)
-            if 1 <= score_float <= 5:
-                ai_score = round(score_float, 2)
-            elif 0 <= score_float <= 100:
-                # Convert percentage to 1-5 scale
-                ai_score = round(1 + 4 * (score_float / 100.0), 2)
-        except (ValueError, TypeError):
-            pass
+    ai_score = normalize_ai_score(ai_score_raw.strip())
     
     # AI Explanation
-    ai_explanation_raw = row.get("ai_cx_score_explanation") or ""
+    explanation_col = plan["explanation"]
+    ai_explanation_raw = row[explanation_col] if explanation_col is not None else ""
     ai_feedback = anonymize_text(ai_explanation_raw) if ai_explanation_raw else None
     
     # Resolution status
-    resolution_status = row.get("conversation_state") or "completed"
+    state_col = plan["state"]
+    resolution_status = (row[state_col] if state_col is not None else "") or "completed"
     
-    return {
+    conv = {
         "conversation_id": conv_id,
         "agent_id": agent_raw,
         "agent_name": agent_name,
@@ -650,11 +967,267 @@ def parse_conversation_row(row: Dict, admins_map: Dict[str, str]) -> Dict:
         "queue_type_360": None,
         "conversation_tags": []
     }
+    
+    # Tags exported with the row are classified here; enrichment skips them
+    tags_col = plan["tags"]
+    tags_raw = row[tags_col].strip() if tags_col is not None else ""
+    if tags_raw:
+        tags = [t for t in _TAG_SPLIT_RE.split(tags_raw) if t]
+        (conv["conversation_tags"], conv["workspace"],
+         conv["is_360_queue"], conv["queue_type_360"]) = classify_tags(tags)
+    
+    return conv
+
+# -----------------------------
+# Supabase Upload
+# -----------------------------
+def upsert_conversations(batches: Iterable[List[Dict]]) -> int:
+    """
+    Upsert batches to qa_metrics as the producer yields them, sent in parallel
+    and retried independently. Returns the number of conversations written.
+    """
+    done = 0
+    pending = {}
+    # Batches never share a conversation_id, so their order does not matter.
+    # At most UPSERT_MAX_IN_FLIGHT batches are held at once: when uploads lag,
+    # the producer (parse + enrich) waits instead of buffering the whole export
+    with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as executor:
+        for batch in batches:
+            if len(pending) >= UPSERT_MAX_IN_FLIGHT:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done += pending.pop(future)
+                logger.info(f"  Upserted {done} conversations")
+            pending[executor.submit(supabase.upsert, "qa_metrics", batch, "conversation_id")] = len(batch)
+        for future in as_completed(pending):
+            future.result()
+            done += pending[future]
+            logger.info(f"  Upserted {done} conversations")
+    return done
+
+QA_METRICS_COLUMNS = (
+    "conversation_id", "agent_id", "agent_name", "metric_date", "ai_score",
+    "ai_feedback", "resolution_status", "response_time_seconds",
+    "customer_satisfaction_score", "rating_source", "workspace",
+    "is_360_queue", "queue_type_360", "conversation_tags"
+)
+
+def copy_conversations(conversations: Iterable[Dict]) -> int:
+    """
+    Upsert conversations with COPY into a temp staging table followed by a
+    single INSERT ... ON CONFLICT, bypassing PostgREST for bulk backfills.
+    """
+    columns = ", ".join(QA_METRICS_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in QA_METRICS_COLUMNS if c != "conversation_id")
+    with psycopg.connect(SUPABASE_DB_URL) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE qa_metrics_staging "
+                "(LIKE qa_metrics INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            count = 0
+            with cur.copy(f"COPY qa_metrics_staging ({columns}) FROM STDIN") as copy:
+                for conv in conversations:
+                    count += 1
+                    copy.write_row([
+                        Jsonb(conv[c]) if c == "conversation_tags" else conv[c]
+                        for c in QA_METRICS_COLUMNS
+                    ])
+            cur.execute(
+                f"INSERT INTO qa_metrics ({columns}) "
+                f"SELECT {columns} FROM qa_metrics_staging "
+                f"ON CONFLICT (conversation_id) DO UPDATE SET {updates}"
+            )
+    logger.info(f"  Copied {count} conversations")
+    return count
+
+# -----------------------------
+# Batch Pipeline
+# -----------------------------
+def fetch_stored_enrichment(conversation_ids: List[str]) -> Dict[str, Dict]:
+    """
+    Return {conversation_id: enrichment fields} for conversations already in
+    qa_metrics with a known workspace. A failed lookup returns what was found
+    so far; those conversations are simply enriched from Intercom again.
+    """
+    stored = {}
+    select = ",".join(("conversation_id",) + ENRICHMENT_COLUMNS)
+    for i in range(0, len(conversation_ids), STORED_LOOKUP_CHUNK):
+        chunk = conversation_ids[i:i + STORED_LOOKUP_CHUNK]
+        try:
+            rows = supabase.select("qa_metrics", {
+                "select": select,
+                "conversation_id": f"in.({','.join(chunk)})",
+                "workspace": "neq.Unknown",
+            })
+        except (requests.RequestException, RuntimeError) as e:
+            logger.warning(f"Stored enrichment lookup failed, re-enriching the rest: {e}")
+            break
+        for row in rows:
+            stored[row.pop("conversation_id")] = row
+    return stored
+
+def enrich_conversations(conversations: List[Dict], reuse_stored: bool = False) -> Tuple[int, int]:
+    """Fill tags/workspace/360 fields in place; returns (enriched_count, failed_count)"""
+    enriched_count = 0
+    failed_count = 0
+    
+    # Conversations whose tags came with the export are already classified
+    pending = [conv for conv in conversations if not conv["conversation_tags"]]
+    enriched_count += len(conversations) - len(pending)
+    conversations = pending
+    
+    # Opt-in: copy fields stored by an earlier run instead of asking Intercom
+    # again. Off by default because tags added after that run (e.g. 360 tags
+    # applied at close) would never be picked up
+    if reuse_stored:
+        stored = fetch_stored_enrichment([conv["conversation_id"] for conv in conversations])
+        if stored:
+            logger.info(f"  Reusing stored tags for {len(stored)} of {len(conversations)} conversations")
+            for conv in conversations:
+                fields = stored.get(conv["conversation_id"])
+                if fields:
+                    conv.update(fields)
+                    enriched_count += 1
+            conversations = [conv for conv in conversations if conv["conversation_id"] not in stored]
+    
+    # One search request per SEARCH_PAGE_SIZE conversations instead of one GET
+    # each; chunks run concurrently and map() keeps input order
+    conversation_ids = [conv["conversation_id"] for conv in conversations]
+    chunks = [conversation_ids[i:i + SEARCH_PAGE_SIZE] for i in range(0, len(conversation_ids), SEARCH_PAGE_SIZE)]
+    with ThreadPoolExecutor(max_workers=ENRICH_WORKERS) as executor:
+        results = chain.from_iterable(executor.map(enrich_conversations_chunk, chunks))
+        
+        for conv, (tags, workspace, is_360, queue_type) in zip(conversations, results):
+            # ALWAYS set these fields, even if enrichment fails
+            # This ensures all conversations have identical key structure
+            if tags or workspace != 'Unknown':
+                conv["conversation_tags"] = tags
+                conv["workspace"] = workspace
+                conv["is_360_queue"] = is_360
+                conv["queue_type_360"] = queue_type
+                enriched_count += 1
+                logger.debug(f"âœ“ {conv['conversation_id']}: {workspace} | 360={is_360} ({queue_type})")
+            else:
+                # Enrichment failed - use default values
+                conv["conversation_tags"] = []
+                conv["workspace"] = 'Unknown'
+                conv["is_360_queue"] = False
+                conv["queue_type_360"] = None
+                failed_count += 1
+    
+    return enriched_count, failed_count
+
+def normalize_conversations(conversations: List[Dict]) -> None:
+    """Ensure every conversation in the batch has identical keys (PostgREST requires it)"""
+    # Collect all unique keys from all conversations
+    all_field_names = set()
+    key_counts = {}
+    for conv in conversations:
+        all_field_names.update(conv.keys())
+        key_signature = str(sorted(conv.keys()))
+        if key_signature not in key_counts:
+            key_counts[key_signature] = {'count': 0, 'example': conv.get('conversation_id')}
+        key_counts[key_signature]['count'] += 1
+    
+    if len(key_counts) > 1:
+        logger.warning(f"âš ï¸  Found {len(key_counts)} different key structures!")
+        for i, (keys, info) in enumerate(key_counts.items(), 1):
+            logger.warning(f"  Structure {i}: {info['count']} conversations (example: {info['example']})")
+            logger.warning(f"    Keys: {keys[:200]}...")  # Truncate if too long
+    
+    # Ensure every conversation has every field (fill missing with None)
+    for conv in conversations:
+        for field_name in all_field_names:
+            if field_name not in conv:
+                conv[field_name] = None
+                logger.debug(f"Added missing field '{field_name}' to {conv.get('conversation_id', 'unknown')}")
+
+def log_sample_structure(conv: Dict) -> None:
+    """DEBUG: Log one conversation to see structure"""
+    logger.info(f"Sample conversation structure (batch 1):")
+    logger.info(f"  Keys: {sorted(conv.keys())}")
+    for key in sorted(conv.keys()):
+        value = conv[key]
+        if value is None:
+            logger.info(f"    {key}: None")
+        elif isinstance(value, str):
+            logger.info(f"    {key}: '{value[:50]}...'")
+        else:
+            logger.info(f"    {key}: {type(value).__name__}")
+
+def iter_conversation_batches(rows: Iterable[List[str]], plan: Dict[str, Any], admins_map: Dict[str, str],
+                              enrich: bool, batch_size: int = UPSERT_BATCH_SIZE,
+                              reuse_stored: bool = False) -> Iterator[List[Dict]]:
+    """
+    Parse export rows (csv.reader lists, header excluded) into qa_metrics
+    batches of batch_size, enriching and normalizing each batch before
+    yielding it. With reuse_stored, conversations already enriched in
+    qa_metrics keep their stored tags instead of being fetched again.
+    Repeated conversation IDs keep their first row only.
+    """
+    row_count = 0
+    parsed_count = 0
+    duplicate_count = 0
+    # Duplicates would be enriched twice, and PostgREST rejects an upsert
+    # batch that touches the same conversation_id more than once
+    seen_ids = set()
+    enriched_total = 0
+    failed_total = 0
+    first_batch = True
+    batch = []
+    
+    def finish(batch: List[Dict]) -> List[Dict]:
+        nonlocal enriched_total, failed_total, first_batch
+        if enrich:
+            enriched, failed = enrich_conversations(batch, reuse_stored=reuse_stored)
+            enriched_total += enriched
+            failed_total += failed
+        normalize_conversations(batch)
+        if first_batch:
+            log_sample_structure(batch[0])
+            first_batch = False
+        return batch
+    
+    width = plan["width"]
+    cid_col = plan["conversation_id"]
+    if cid_col is None:
+        logger.error("Export has no conversation_id column; nothing to sync")
+        rows = ()
+    
+    for row in rows:
+        row_count += 1
+        # Pad ragged rows so every plan position can be indexed
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        conv_id = row[cid_col]
+        if not conv_id:
+            continue
+        if conv_id in seen_ids:
+            duplicate_count += 1
+            continue
+        seen_ids.add(conv_id)
+        batch.append(parse_conversation_row(row, plan, admins_map))
+        parsed_count += 1
+        if len(batch) >= batch_size:
+            yield finish(batch)
+            batch = []
+    if batch:
+        yield finish(batch)
+    
+    logger.info(f"Downloaded {row_count} rows from Intercom")
+    logger.info(f"Parsed {parsed_count} conversations")
+    if duplicate_count:
+        logger.info(f"Skipped {duplicate_count} duplicate conversation rows")
+    if enrich:
+        logger.info(f"Enrichment complete: {enriched_total} succeeded, {failed_total} failed")
 
 # -----------------------------
 # Main Sync Function
 # -----------------------------
-def sync_conversations(start_unix: int, end_unix: int, enrich: bool = True) -> int:
+def sync_conversations(start_unix: int, end_unix: int, enrich: bool = True, bulk: bool = False,
+                       refresh_admins: bool = False, reuse_stored: bool = False) -> int:
     """
     Main sync workflow.
     
@@ -662,6 +1235,10 @@ def sync_conversations(start_unix: int, end_unix: int, enrich: bool = True) -> i
         start_unix: Start timestamp (Unix seconds)
         end_unix: End timestamp (Unix seconds)
         enrich: Whether to fetch individual conversations for tags
+        bulk: Load via Postgres COPY instead of PostgREST upserts
+        refresh_admins: Ignore the on-disk admins cache and re-fetch /admins
+        reuse_stored: Keep stored tags for conversations already enriched instead
+            of fetching them from Intercom again
     
     Returns:
         Number of conversations processed
@@ -669,7 +1246,7 @@ def sync_conversations(start_unix: int, end_unix: int, enrich: bool = True) -> i
     
     # Step 1: Fetch admin/teammate map
     logger.info("Step 1: Fetching admin/teammate names...")
-    admins_map = fetch_all_admins_map()
+    admins_map = fetch_all_admins_map(refresh=refresh_admins)
     
     # Step 2: Enqueue export
     logger.info("Step 2: Enqueueing Intercom export...")
@@ -686,6 +1263,14 @@ def sync_conversations(start_unix: int, end_unix: int, enrich: bool = True) -> i
         "fin_ai_agent_rating",
         "ai_cx_score_explanation"
     ]
+    tags_attribute = None
+    if EXPORT_TAGS_ATTRIBUTE:
+        if verify_export_attribute(EXPORT_TAGS_ATTRIBUTE):
+            tags_attribute = EXPORT_TAGS_ATTRIBUTE
+            attribute_ids.append(tags_attribute)
+        else:
+            logger.warning(f"Export attribute {EXPORT_TAGS_ATTRIBUTE!r} is not in the conversation "
+                           f"dataset; tags will come from enrichment")
     
     job_id, _ = enqueue_export(start_unix, end_unix, attribute_ids)
     
@@ -695,164 +1280,45 @@ def sync_conversations(start_unix: int, end_unix: int, enrich: bool = True) -> i
     
     # Step 4: Download
     logger.info("Step 4: Downloading export data...")
-    content = download_export(job_resp, job_id)
+    export_file = download_export(job_resp, job_id)
     
-    # Step 5: Parse
+    # Step 5: Parse (streamed; rows are decoded as the transform consumes them)
     logger.info("Step 5: Parsing export data...")
-    rows = parse_export_bytes(content)
-    logger.info(f"Downloaded {len(rows)} rows from Intercom")
+    rows = iter_export_rows(export_file)
+    header = next(rows, None)
+    sample_rows = list(islice(rows, 3))
     
-    if not rows:
+    if not sample_rows:
         logger.info("No conversations to process")
         return 0
 
     # TEMPORARY DIAGNOSTIC - remove after confirming AI score issue
-    logger.info(f"CSV HEADERS: {list(rows[0].keys())}")
+    logger.info(f"CSV HEADERS: {header}")
     ai_fields = ['ai_cx_score_rating', 'conversation_rating', 'fin_ai_agent_rating', 'ai_cx_score_explanation']
-    present = [f for f in ai_fields if f in rows[0]]
-    missing = [f for f in ai_fields if f not in rows[0]]
+    present = [f for f in ai_fields if f in header]
+    missing = [f for f in ai_fields if f not in header]
     logger.info(f"AI score fields PRESENT: {present}")
     logger.info(f"AI score fields MISSING: {missing}")
-    for i, sample_row in enumerate(rows[:3]):
+    for i, sample_row in enumerate(sample_rows):
+        sample = dict(zip(header, sample_row))
         logger.info(f"Row {i+1} AI values: " + ", ".join(
-            f"{f}={repr(sample_row.get(f, 'MISSING'))}" for f in ai_fields
+            f"{f}={repr(sample.get(f, 'MISSING'))}" for f in ai_fields
         ))
     # END TEMPORARY DIAGNOSTIC
 
-    # Step 6: Transform rows
-    logger.info("Step 6: Transforming conversation data...")
-    conversations = []
-    for row in rows:
-        conv_id = row.get("conversation_id")
-        if not conv_id:
-            continue
-        
-        parsed = parse_conversation_row(row, admins_map)
-        conversations.append(parsed)
-    
-    logger.info(f"Parsed {len(conversations)} conversations")
-    
-    # Step 7: Enrich with tags (optional, can be slow for large batches)
-    if enrich and conversations:
-        logger.info("Step 7: Enriching conversations with tags...")
-        batch_size = 10
-        delay_between_batches = 0.5  # seconds
-        
-        enriched_count = 0
-        failed_count = 0
-        
-        for i in range(0, len(conversations), batch_size):
-            batch = conversations[i:i + batch_size]
-            
-            for conv in batch:
-                tags, workspace, is_360, queue_type = enrich_conversation_with_tags(conv["conversation_id"])
-                
-                # ALWAYS set these fields, even if enrichment fails
-                # This ensures all conversations have identical key structure
-                if tags or workspace != 'Unknown':
-                    conv["conversation_tags"] = tags
-                    conv["workspace"] = workspace
-                    conv["is_360_queue"] = is_360
-                    conv["queue_type_360"] = queue_type
-                    enriched_count += 1
-                    logger.debug(f"âœ“ {conv['conversation_id']}: {workspace} | 360={is_360} ({queue_type})")
-                else:
-                    # Enrichment failed - use default values
-                    conv["conversation_tags"] = []
-                    conv["workspace"] = 'Unknown'
-                    conv["is_360_queue"] = False
-                    conv["queue_type_360"] = None
-                    failed_count += 1
-            
-            # Rate limiting
-            if i + batch_size < len(conversations):
-                time.sleep(delay_between_batches)
-        
-        logger.info(f"Enrichment complete: {enriched_count} succeeded, {failed_count} failed")
+    # Steps 6-8 run as one pipeline: each batch is parsed, enriched and
+    # normalized while earlier batches upload, so memory stays O(batch)
+    logger.info(f"Steps 6-8: Transforming, {'enriching' if enrich else 'not enriching'} "
+                f"and {'copying' if bulk else 'upserting'} conversations...")
+    plan = build_column_plan(header, tags_attribute)
+    batches = iter_conversation_batches(chain(sample_rows, rows), plan, admins_map, enrich, reuse_stored=reuse_stored)
+    if bulk:
+        count = copy_conversations(chain.from_iterable(batches))
     else:
-        logger.info("Step 7: Skipping enrichment (disabled)")
-        
-        # CRITICAL: If enrichment is disabled, still initialize fields
-        for conv in conversations:
-            if "conversation_tags" not in conv:
-                conv["conversation_tags"] = []
-            if "workspace" not in conv:
-                conv["workspace"] = 'Unknown'
-            if "is_360_queue" not in conv:
-                conv["is_360_queue"] = False
-            if "queue_type_360" not in conv:
-                conv["queue_type_360"] = None
-
-    # Step 7.5: NORMALIZE - Ensure all conversations have identical keys
-    logger.info("Step 7.5: Normalizing conversation structures...")
-
-    # Collect all unique keys from all conversations
-    all_field_names = set()
-    for conv in conversations:
-        all_field_names.update(conv.keys())
-
-    logger.info(f"Expected fields: {sorted(all_field_names)}")
-
-    # Ensure every conversation has every field (fill missing with None)
-    for conv in conversations:
-        for field_name in all_field_names:
-            if field_name not in conv:
-                conv[field_name] = None
-                logger.debug(f"Added missing field '{field_name}' to {conv.get('conversation_id', 'unknown')}")
-
-    logger.info(f"âœ“ All {len(conversations)} conversations now have {len(all_field_names)} fields")
+        count = upsert_conversations(batches)
     
-    # Step 8: Upsert to Supabase
-    logger.info(f"Step 8: Upserting {len(conversations)} conversations to Supabase...")
-
-    # DEBUG: Check for key mismatches BEFORE upserting
-    logger.info("Checking for key mismatches...")
-    all_keys = set()
-    key_counts = {}
-
-    for conv in conversations:
-        conv_keys = frozenset(conv.keys())
-        all_keys.update(conv.keys())
-        
-        key_signature = str(sorted(conv.keys()))
-        if key_signature not in key_counts:
-            key_counts[key_signature] = {'count': 0, 'example': conv['conversation_id']}
-        key_counts[key_signature]['count'] += 1
-
-    logger.info(f"Total unique keys across all conversations: {len(all_keys)}")
-    logger.info(f"All keys: {sorted(all_keys)}")
-
-    if len(key_counts) > 1:
-        logger.warning(f"âš ï¸  Found {len(key_counts)} different key structures!")
-        for i, (keys, info) in enumerate(key_counts.items(), 1):
-            logger.warning(f"  Structure {i}: {info['count']} conversations (example: {info['example']})")
-            logger.warning(f"    Keys: {keys[:200]}...")  # Truncate if too long
-    else:
-        logger.info("âœ“ All conversations have identical key structure")
-
-    # Process in batches for reliability
-    batch_size = 100
-    for i in range(0, len(conversations), batch_size):
-        batch = conversations[i:i + batch_size]
-        
-        # DEBUG: Log first conversation in batch to see structure
-        if i == 0:
-            logger.info(f"Sample conversation structure (batch 1):")
-            logger.info(f"  Keys: {sorted(batch[0].keys())}")
-            for key in sorted(batch[0].keys()):
-                value = batch[0][key]
-                if value is None:
-                    logger.info(f"    {key}: None")
-                elif isinstance(value, str):
-                    logger.info(f"    {key}: '{value[:50]}...'")
-                else:
-                    logger.info(f"    {key}: {type(value).__name__}")
-        
-        supabase.upsert("qa_metrics", batch, on_conflict="conversation_id")
-        logger.info(f"  Upserted batch {i//batch_size + 1}/{(len(conversations)-1)//batch_size + 1}")
-    
-    logger.info(f"âœ… Sync complete! Processed {len(conversations)} conversations")
-    return len(conversations)
+    logger.info(f"âœ… Sync complete! Processed {count} conversations")
+    return count
 
 # -----------------------------
 # CLI Entry Point
@@ -873,8 +1339,29 @@ def main():
         help="Skip fetching individual conversations for tags (faster but no workspace info)"
     )
     
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Load rows with Postgres COPY over SUPABASE_DB_URL (fast historical backfills)"
+    )
+    
+    parser.add_argument(
+        "--refresh-admins",
+        action="store_true",
+        help="Re-fetch the Intercom admin list instead of using the cached copy"
+    )
+    
+    parser.add_argument(
+        "--reuse-stored-tags",
+        action="store_true",
+        help="Keep stored tags for conversations already enriched in Supabase (faster re-runs; misses new tags)"
+    )
+    
     args = parser.parse_args()
     
+    if args.bulk and not (psycopg and SUPABASE_DB_URL):
+        parser.error("--bulk needs the psycopg package and SUPABASE_DB_URL")
+    
     now = int(time.time())
     start_unix = now - (args.days * 24 * 60 * 60)
     end_unix = now
@@ -893,7 +1380,8 @@ def main():
     logger.info(f"=" * 60)
     
     try:
-        count = sync_conversations(start_unix, end_unix, enrich=not args.no_enrich)
+        count = sync_conversations(start_unix, end_unix, enrich=not args.no_enrich, bulk=args.bulk,
+                                   refresh_admins=args.refresh_admins, reuse_stored=args.reuse_stored_tags)
         logger.info(f"âœ… SUCCESS: Synced {count} conversations")
         return 0
     except Exception as e:
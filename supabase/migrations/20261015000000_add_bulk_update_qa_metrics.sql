@@ -0,0 +1,48 @@
+/*
+  # Bulk Update for qa_metrics Backfills
+
+  ## Summary
+  Adds `bulk_update_qa_metrics(rows jsonb)` so backfill scripts can update
+  many conversations in a single request instead of one PATCH per row.
+
+  ## Changes Made
+  1. **Function**: `bulk_update_qa_metrics(rows jsonb) RETURNS integer`
+     - `rows` is a JSON array of objects keyed by `conversation_id`
+     - Updates `workspace`, `is_360_queue`, `queue_type_360`, `conversation_tags`
+     - Only overwrites `metric_date` when the row provides one
+     - Returns the number of rows updated
+
+  ## Notes
+  - Plain UPDATE (not upsert): unknown conversation IDs are ignored
+  - Intended for the service role used by backfill_dates_and_workspace.py
+*/
+
+CREATE OR REPLACE FUNCTION bulk_update_qa_metrics(rows jsonb)
+RETURNS integer AS $$
+DECLARE
+  updated_count integer;
+BEGIN
+  UPDATE qa_metrics m
+  SET
+    workspace = r.workspace,
+    is_360_queue = r.is_360_queue,
+    queue_type_360 = r.queue_type_360,
+    conversation_tags = COALESCE(r.conversation_tags, '[]'::jsonb),
+    metric_date = COALESCE(r.metric_date::timestamptz, m.metric_date)
+  FROM jsonb_to_recordset(rows) AS r(
+    conversation_id text,
+    workspace text,
+    is_360_queue boolean,
+    queue_type_360 text,
+    conversation_tags jsonb,
+    metric_date date
+  )
+  WHERE m.conversation_id = r.conversation_id;
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE EXECUTE ON FUNCTION bulk_update_qa_metrics(jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION bulk_update_qa_metrics(jsonb) TO service_role;
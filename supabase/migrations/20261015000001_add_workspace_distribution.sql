@@ -0,0 +1,26 @@
+/*
+  # Workspace Distribution Function
+
+  ## Summary
+  Adds `workspace_distribution()` so maintenance scripts can count
+  conversations per workspace without downloading every qa_metrics row.
+
+  ## Changes Made
+  1. **Function**: `workspace_distribution() RETURNS TABLE (workspace, conversation_count)`
+     - Runs `GROUP BY workspace` over `qa_metrics`
+     - Result size is the number of distinct workspaces, not the table size
+
+  ## Notes
+  - Used by fix_workspace_names.py for its before/after report
+*/
+
+CREATE OR REPLACE FUNCTION workspace_distribution()
+RETURNS TABLE (workspace text, conversation_count bigint) AS $$
+  SELECT m.workspace, count(*)
+  FROM qa_metrics m
+  GROUP BY m.workspace
+  ORDER BY count(*) DESC;
+$$ LANGUAGE sql STABLE;
+
+REVOKE EXECUTE ON FUNCTION workspace_distribution() FROM PUBLIC, anon;
+GRANT EXECUTE ON FUNCTION workspace_distribution() TO authenticated, service_role;
@@ -0,0 +1,156 @@
+/*
+  # Classify Workspace and 360 Queue in the Database
+
+  ## Summary
+  `assign_workspace_from_tags` now derives `workspace`, `is_360_queue` and
+  `queue_type_360` from `conversation_tags` using the same rules as
+  scripts/intercom_supabase_sync.py, so clients only need to write tags.
+
+  ## Changes Made
+  1. **Function**: `classify_conversation_tags(tags jsonb)`
+     - Returns `(workspace, is_360_queue, queue_type_360)` for a tag array,
+       or NULLs when there are no tags
+     - Workspace keywords (substring, case-insensitive):
+       `skyprivate` -> SkyPrivate, `cmd` / `cammodeldirectory` -> CamModelDirectory
+     - Billing 360 patterns: `billing - top-up issue`, `billing verifications`,
+       `3 - payments`, `3 - refunds`
+     - CEQ 360 patterns: `ceq verifications`, `public profile`, `3 - reports`,
+       `3 - scammers`
+     - 360 conversations get a `360_` workspace prefix; 360 conversations
+       with no workspace keyword default to `360_SkyPrivate`
+     - Canonical names (`SkyPrivate`) replace the old lowercase values
+  2. **Trigger function**: `assign_workspace_from_tags()` applies
+     `classify_conversation_tags`; the trigger only reclassifies on INSERT or
+     when `conversation_tags` changes, so later manual corrections are kept
+  3. **Function**: `bulk_update_qa_metrics(rows jsonb)` now only writes
+     `conversation_tags` and `metric_date`; the trigger fills in the rest
+  4. **Backfill**: existing rows with tags are reclassified once, fixing
+     lowercase names and 360 rows without the `360_` prefix left by the old
+     trigger
+
+  ## Notes
+  - Rows with empty or NULL tags keep whatever workspace the writer sent
+  - On INSERT this overrides the classification sent by the
+    `sync-intercom-conversations` edge function, whose broader keywords
+    (`payment`, `report`, `verification`, ...) and missing `360_` prefix
+    disagree with the Python sync; the database rules are now authoritative
+*/
+
+CREATE OR REPLACE FUNCTION classify_conversation_tags(
+  tags jsonb,
+  OUT workspace text,
+  OUT is_360_queue boolean,
+  OUT queue_type_360 text
+) AS $$
+DECLARE
+  tag_text text;
+  base_workspace text := 'Unknown';
+  is_billing boolean;
+  is_ceq boolean;
+BEGIN
+  IF tags IS NULL OR jsonb_typeof(tags) <> 'array' OR jsonb_array_length(tags) = 0 THEN
+    RETURN;
+  END IF;
+
+  -- All tags joined into one lowercase string, matching the Python CONTAINS logic
+  SELECT lower(string_agg(t, ' ')) INTO tag_text
+  FROM jsonb_array_elements_text(tags) AS t;
+
+  IF position('skyprivate' IN tag_text) > 0 THEN
+    base_workspace := 'SkyPrivate';
+  ELSIF position('cmd' IN tag_text) > 0 OR position('cammodeldirectory' IN tag_text) > 0 THEN
+    base_workspace := 'CamModelDirectory';
+  END IF;
+
+  is_billing := position('billing - top-up issue' IN tag_text) > 0
+    OR position('billing verifications' IN tag_text) > 0
+    OR position('3 - payments' IN tag_text) > 0
+    OR position('3 - refunds' IN tag_text) > 0;
+
+  is_ceq := position('ceq verifications' IN tag_text) > 0
+    OR position('public profile' IN tag_text) > 0
+    OR position('3 - reports' IN tag_text) > 0
+    OR position('3 - scammers' IN tag_text) > 0;
+
+  is_360_queue := is_billing OR is_ceq;
+  queue_type_360 := CASE
+    WHEN is_billing AND is_ceq THEN 'both'
+    WHEN is_billing THEN 'billing'
+    WHEN is_ceq THEN 'ceq'
+    ELSE NULL
+  END;
+
+  IF is_360_queue THEN
+    workspace := CASE
+      WHEN base_workspace = 'Unknown' THEN '360_SkyPrivate'
+      ELSE '360_' || base_workspace
+    END;
+  ELSE
+    workspace := base_workspace;
+  END IF;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+DROP FUNCTION IF EXISTS assign_workspace_from_tags CASCADE;
+
+CREATE OR REPLACE FUNCTION assign_workspace_from_tags()
+RETURNS TRIGGER AS $$
+DECLARE
+  c record;
+BEGIN
+  IF TG_OP = 'UPDATE' AND NEW.conversation_tags IS NOT DISTINCT FROM OLD.conversation_tags THEN
+    RETURN NEW;
+  END IF;
+
+  SELECT * INTO c FROM classify_conversation_tags(NEW.conversation_tags);
+  IF c.workspace IS NULL THEN
+    RETURN NEW;
+  END IF;
+
+  NEW.workspace := c.workspace;
+  NEW.is_360_queue := c.is_360_queue;
+  NEW.queue_type_360 := c.queue_type_360;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS assign_workspace_trigger ON qa_metrics;
+CREATE TRIGGER assign_workspace_trigger
+  BEFORE INSERT OR UPDATE ON qa_metrics
+  FOR EACH ROW
+  EXECUTE FUNCTION assign_workspace_from_tags();
+
+-- One-time reclassification of rows written under the old rules. Tags are
+-- unchanged here, so the trigger above leaves these assignments alone.
+UPDATE qa_metrics m
+SET
+  workspace = c.workspace,
+  is_360_queue = c.is_360_queue,
+  queue_type_360 = c.queue_type_360
+FROM qa_metrics src
+CROSS JOIN LATERAL classify_conversation_tags(src.conversation_tags) AS c
+WHERE m.id = src.id
+  AND c.workspace IS NOT NULL
+  AND (m.workspace, m.is_360_queue, m.queue_type_360)
+      IS DISTINCT FROM (c.workspace, c.is_360_queue, c.queue_type_360);
+
+CREATE OR REPLACE FUNCTION bulk_update_qa_metrics(rows jsonb)
+RETURNS integer AS $$
+DECLARE
+  updated_count integer;
+BEGIN
+  UPDATE qa_metrics m
+  SET
+    conversation_tags = COALESCE(r.conversation_tags, '[]'::jsonb),
+    metric_date = COALESCE(r.metric_date::timestamptz, m.metric_date)
+  FROM jsonb_to_recordset(rows) AS r(
+    conversation_id text,
+    conversation_tags jsonb,
+    metric_date date
+  )
+  WHERE m.conversation_id = r.conversation_id;
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql;
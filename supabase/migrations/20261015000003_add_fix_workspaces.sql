@@ -0,0 +1,40 @@
+/*
+  # Fix Workspace Names in One Statement
+
+  ## Summary
+  Adds `fix_workspaces()`, which canonicalises lowercase workspace names and
+  applies the 360_ prefix in a single UPDATE instead of four separate ones.
+
+  ## Changes Made
+  1. **Function**: `fix_workspaces() RETURNS TABLE (workspace, updated_count)`
+     - `skyprivate` -> `SkyPrivate`, `cammodeldirectory` -> `CamModelDirectory`
+     - 360 queue rows in either spelling -> `360_SkyPrivate` / `360_CamModelDirectory`
+     - Returns how many rows were moved into each workspace
+
+  ## Notes
+  - Used by fix_workspace_names.py
+  - Idempotent: rows already in their canonical workspace are not touched
+*/
+
+CREATE OR REPLACE FUNCTION fix_workspaces()
+RETURNS TABLE (workspace text, updated_count bigint) AS $$
+  WITH updated AS (
+    UPDATE qa_metrics m
+    SET workspace = CASE
+      WHEN m.is_360_queue AND m.workspace IN ('SkyPrivate', 'skyprivate') THEN '360_SkyPrivate'
+      WHEN m.is_360_queue AND m.workspace IN ('CamModelDirectory', 'cammodeldirectory') THEN '360_CamModelDirectory'
+      WHEN m.workspace = 'skyprivate' THEN 'SkyPrivate'
+      WHEN m.workspace = 'cammodeldirectory' THEN 'CamModelDirectory'
+      ELSE m.workspace
+    END
+    WHERE m.workspace IN ('skyprivate', 'cammodeldirectory')
+       OR (m.is_360_queue AND m.workspace IN ('SkyPrivate', 'CamModelDirectory'))
+    RETURNING m.workspace
+  )
+  SELECT u.workspace, count(*)
+  FROM updated u
+  GROUP BY u.workspace;
+$$ LANGUAGE sql VOLATILE;
+
+REVOKE EXECUTE ON FUNCTION fix_workspaces() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION fix_workspaces() TO service_role;
@@ -0,0 +1,55 @@
+/*
+  # Skip Unchanged Rows in bulk_update_qa_metrics
+
+  ## Summary
+  Re-running a backfill rewrote every row even when nothing had changed,
+  firing the workspace trigger and generating WAL for no-op updates.
+
+  ## Changes Made
+  1. **Function**: `bulk_update_qa_metrics(rows jsonb)`
+     - Only updates rows whose `conversation_tags` or `metric_date` would
+       actually change, or whose stored `workspace` / `is_360_queue` /
+       `queue_type_360` differ from what the tags imply (`IS DISTINCT FROM`)
+     - Writes the derived columns from `classify_conversation_tags()` itself,
+       since the trigger skips updates that leave the tags unchanged
+     - Rows sent with empty tags keep their current classification
+     - Return value now counts only rows that really changed
+*/
+
+CREATE OR REPLACE FUNCTION bulk_update_qa_metrics(rows jsonb)
+RETURNS integer AS $$
+DECLARE
+  updated_count integer;
+BEGIN
+  UPDATE qa_metrics m
+  SET
+    conversation_tags = n.conversation_tags,
+    metric_date = n.metric_date,
+    workspace = n.workspace,
+    is_360_queue = n.is_360_queue,
+    queue_type_360 = n.queue_type_360
+  FROM (
+    SELECT
+      cur.id,
+      COALESCE(r.conversation_tags, '[]'::jsonb) AS conversation_tags,
+      COALESCE(r.metric_date::timestamptz, cur.metric_date) AS metric_date,
+      COALESCE(c.workspace, cur.workspace) AS workspace,
+      CASE WHEN c.workspace IS NULL THEN cur.is_360_queue ELSE c.is_360_queue END AS is_360_queue,
+      CASE WHEN c.workspace IS NULL THEN cur.queue_type_360 ELSE c.queue_type_360 END AS queue_type_360
+    FROM jsonb_to_recordset(rows) AS r(
+      conversation_id text,
+      conversation_tags jsonb,
+      metric_date date
+    )
+    JOIN qa_metrics cur ON cur.conversation_id = r.conversation_id
+    CROSS JOIN LATERAL classify_conversation_tags(r.conversation_tags) AS c
+  ) n
+  WHERE m.id = n.id
+    AND (m.conversation_tags, m.metric_date, m.workspace, m.is_360_queue, m.queue_type_360)
+        IS DISTINCT FROM
+        (n.conversation_tags, n.metric_date, n.workspace, n.is_360_queue, n.queue_type_360);
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql;
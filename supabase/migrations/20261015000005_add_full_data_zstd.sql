@@ -0,0 +1,21 @@
+/*
+  # Compressed Raw Conversation Payloads
+
+  ## Summary
+  `conversation_threads.full_data` holds the complete Intercom response
+  (often hundreds of KB). Adds an optional zstd-compressed copy so bulk
+  syncs can upload and store the payload at a fraction of the size.
+
+  ## Changes Made
+  1. **Column**: `conversation_threads.full_data_zstd` (bytea, nullable)
+     - zstd-compressed UTF-8 JSON of the Intercom conversation
+     - Written by `fetch_conversation_thread.py --compress-full-data`,
+       which leaves `full_data` NULL for those rows
+
+  ## Notes
+  - Existing rows and the edge function keep using `full_data` (jsonb)
+  - Readers should decompress `full_data_zstd` when `full_data` is NULL
+*/
+
+ALTER TABLE conversation_threads
+  ADD COLUMN IF NOT EXISTS full_data_zstd BYTEA;